@@ -5,37 +5,646 @@ This file is licensed under the terms of the MIT license.
 See <https://github.com/expertanalytics/frost/blob/master/LICENSE>
 """
 
+import concurrent.futures
 import configparser
+import argparse
+import csv
+import urllib.parse
+import importlib.util
+import abc
+import functools
+import collections
+import itertools
+import warnings
+import threading
 import requests
 import datetime
 import inspect
+import asyncio
 import typing
+import tempfile
+import array
+import json
+import zoneinfo
 import math
+import mmap
+import calendar
+import struct
+import bisect
+import re
+import time
 import sys
 import os
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# numpy is imported on first use by import_numpy()
+np = None
+
+if typing.TYPE_CHECKING:
+    # Only for annotations, pyarrow is imported on first use, see import_optional()
+    import pyarrow as pa
+
+try:
+    import fcntl
+except ImportError:
+    # Not on Windows, where ObservationStore.write() runs without a lock
+    fcntl = None
+
+
+# Offer brotli only when urllib3 has a decoder for it
+ACCEPT_ENCODING = 'gzip, deflate' + (', br' if importlib.util.find_spec('brotli') or
+                                     importlib.util.find_spec('brotlicffi') else '')
+
+
+def json_loads(content) -> 'json':
+    """
+    Description:
+        Decodes JSON straight from a raw response body. Uses orjson when it
+        is installed, which parses the bytes without a str copy. The
+        standard library fallback decodes to str first, and has to copy a
+        memory-mapped body onto the heap before that.
+    Args:
+        content:    raw response body as bytes, or a memory map of a spooled
+                    body
+    """
+    if orjson is not None:
+        if isinstance(content, mmap.mmap):
+            content = memoryview(content)
+        return orjson.loads(content)
+    if isinstance(content, mmap.mmap):
+        content = content[:]
+    return json.loads(content)
+
+
+def flatten_observations(content) -> dict:
+    """
+    Description:
+        Decodes a raw /observations response body, flattens it with
+        observation_columns() and dictionary-encodes the string columns with
+        encode_columns(). Used in worker processes, where the encoded
+        columns are much cheaper to send back than lists of str.
+    Args:
+        content:    raw response body as bytes
+    """
+    return encode_columns(observation_columns(json_loads(content)))
+
+
+def encode_columns(columns: dict) -> dict:
+    """
+    Description:
+        Dictionary-encodes the string columns from observation_columns() as
+        (codes, categories), with the codes in an array.array of int32.
+        Numeric columns are kept as they are.
+    Args:
+        columns:    columns from observation_columns()
+    """
+    encoded = {}
+    for name, column in columns.items():
+        if isinstance(column, array.array):
+            encoded[name] = column
+            continue
+        categories = {}
+        codes = array.array('i', [categories.setdefault(value, len(categories))
+                                  for value in column])
+        encoded[name] = (codes, list(categories))
+    return encoded
+
+
+def decode_columns(encoded: dict) -> dict:
+    """
+    Description:
+        Inverse of encode_columns(). The decoded string columns refer to the
+        category strings, so each distinct string is only stored once.
+    Args:
+        encoded:    columns from encode_columns()
+    """
+    columns = {}
+    for name, column in encoded.items():
+        if isinstance(column, array.array):
+            columns[name] = column
+        else:
+            codes, categories = column
+            columns[name] = [categories[code] for code in codes]
+    return columns
+
+
+def observation_columns(response_json: dict) -> dict:
+    """
+    Description:
+        Flattens the nested observations of an /observations response into
+        columns with one row per observed value. Numeric columns are
+        array.array buffers so they are cheap to send between processes.
+        Missing quality codes are stored as -1, and levels as JSON text or 
+        None.
+    Args:
+        response_json:  decoded response from get_observations()
+    """
+    columns = {'sourceId': [],
+               'referenceTime': [],
+               'elementId': [],
+               'value': array.array('d'),
+               'unit': [],
+               'qualityCode': array.array('i'),
+               'timeOffset': [],
+               'timeResolution': [],
+               'level': []}
+    levels = {}
+    for item in response_json['data']:
+        for observation in item['observations']:
+            columns['sourceId'].append(item['sourceId'])
+            columns['referenceTime'].append(item['referenceTime'])
+            columns['elementId'].append(observation['elementId'])
+            columns['value'].append(float(observation['value']))
+            columns['unit'].append(observation.get('unit'))
+            columns['qualityCode'].append(int(observation.get('qualityCode', -1)))
+            columns['timeOffset'].append(observation.get('timeOffset'))
+            columns['timeResolution'].append(observation.get('timeResolution'))
+            level = observation.get('level')
+            if level:
+                # Few distinct levels, so each is only encoded once
+                key = (level.get('levelType'), level.get('value'), level.get('unit'))
+                if key not in levels:
+                    levels[key] = json.dumps(level, sort_keys=True)
+                level = levels[key]
+            columns['level'].append(level)
+    return columns
+
+
+# Frost /sources fields that each Station attribute is built from
+STATION_FIELDS = {'station_id': 'id',
+                  'name': 'name',
+                  'coords': 'geometry',
+                  'valid_from': 'validFrom',
+                  'municipality': 'municipality'}
+
+# Frost /observations/availableTimeSeries fields used by Stations
+TIME_SERIES_FIELDS = ['elementId', 'validFrom', 'timeResolution']
+
+
+def projection(attributes: list,
+               mapping: dict = None) -> str:
+    """
+    Description:
+        Translates the attributes a caller uses into the minimal comma 
+        separated fields parameter for a Frost request
+    Args:
+        attributes: names of the attributes that are used
+        mapping:    from attribute name to Frost field name, attributes not 
+                    in the mapping are used as Frost field names directly
+    """
+    mapping = mapping or {}
+    fields = []
+    for attribute in attributes:
+        field = mapping.get(attribute, attribute)
+        if field not in fields:
+            fields.append(field)
+    return ','.join(fields)
+
+
+def duration_seconds(duration: str) -> float:
+    """
+    Description:
+        Converts an ISO-8601 duration such as the Frost timeResolution 
+        'PT10M', 'PT1H' or 'P1D' to seconds. Months and years are counted as 
+        30 and 365 days.
+    Args:
+        duration:   ISO-8601 duration string
+    """
+    match = re.fullmatch(r'P(?:(\d+)Y)?(?:(\d+)M)?(?:(\d+)W)?(?:(\d+)D)?'
+                         r'(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+(?:\.\d+)?)S)?)?',
+                         duration)
+    if not match:
+        raise ValueError(f'Not an ISO-8601 duration: {duration}')
+    years, months, weeks, days, hours, minutes, seconds = (float(part or 0)
+                                                           for part in match.groups())
+    return (((years*365 + months*30 + weeks*7 + days)*24 + hours)*60 + minutes)*60 + seconds
+
+
+def require(module: object,
+            name: str,
+            extra: str) -> None:
+    """
+    Description:
+        Raises an ImportError for features that need an optional dependency 
+        when it is not installed
+    Args:
+        module: the imported module, None if the import failed
+        name:   name of the package
+        extra:  name of the setup.py extra that installs it
+    """
+    if module is None:
+        raise ImportError(f'{name} is needed for this feature, install frost[{extra}]')
+
+
+def import_optional(name: str,
+                    extra: str) -> object:
+    """
+    Description:
+        Imports an optional dependency on first use, so heavy packages such 
+        as pyarrow do not slow down importing frost. Raises the ImportError 
+        of require() when it is not installed.
+    Args:
+        name:   module name, e.g. pyarrow.parquet
+        extra:  name of the setup.py extra that installs it
+    """
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        require(None, name.split('.')[0], extra)
+
+
+def import_numpy(extra: str = 'analysis') -> object:
+    """
+    Description:
+        Imports numpy on first use as the module global np, see 
+        import_optional(). Called by every public entry point that needs 
+        numpy, so methods of objects built by one can use np directly.
+    Args:
+        extra:  name of the setup.py extra to suggest when it is missing
+    """
+    global np
+    if np is None:
+        np = import_optional('numpy', extra)
+    return np
+
+
+def bracket(grid: 'np.ndarray', x: 'np.ndarray') -> tuple:
+    """
+    Description:
+        Finds the grid intervals for linear interpolation. Returns lower and 
+        upper grid indices and the weight of the upper one, with x clamped 
+        to the grid range.
+    Args:
+        grid:   sorted 1D grid
+        x:      points to interpolate at
+    """
+    import_numpy()
+    if len(grid) == 1:
+        zeros = np.zeros(np.shape(x), dtype=int)
+        return zeros, zeros, np.zeros(np.shape(x))
+    x = np.clip(x, grid[0], grid[-1])
+    lower = np.clip(np.searchsorted(grid, x) - 1, 0, len(grid) - 2)
+    weight = (x - grid[lower])/(grid[lower + 1] - grid[lower])
+    return lower, lower + 1, weight
+
+
+class CredentialsError(Exception):
+    """
+    Raised when no usable Frost API credentials can be found
+    """
+
+
+class Credentials(typing.NamedTuple):
+    client_id: str
+    client_secret: str = None
+
+
+@functools.lru_cache(maxsize=None)
+def read_credentials(path: str) -> Credentials:
+    """
+    Description:
+        Reads credentials from a file in the format described in README.md. 
+        Each path is only read once per process.
+    Args:
+        path:   path to the credentials file
+    """
+    secret = configparser.ConfigParser()
+    if not secret.read(path) or 'SECRET' not in secret:
+        raise CredentialsError(f'No [SECRET] section in {path}, see README.md for details')
+    if 'xxxxxxxx' in secret['SECRET'].get('client_id', 'xxxxxxxx'):
+        raise CredentialsError(f'You need to change from the default credentials in {path}')
+    return Credentials(client_id = secret['SECRET']['client_id'],
+                       client_secret = secret['SECRET'].get('client_secret'))
+
+
+def load_credentials(*,
+                     credentials: Credentials = None,
+                     path: str = None) -> Credentials:
+    """
+    Description:
+        Resolves the Frost API credentials without side effects. In order of 
+        precedence: an injected Credentials object, an explicit file path, 
+        the FROST_CLIENT_ID and FROST_CLIENT_SECRET environment variables and 
+        credentials.txt in the current working directory.
+    Args:
+        credentials:    credentials to use as they are
+        path:           path to a credentials file
+    """
+    if credentials:
+        return credentials
+    if path:
+        return read_credentials(os.path.abspath(path))
+    if os.environ.get('FROST_CLIENT_ID'):
+        return Credentials(client_id = os.environ['FROST_CLIENT_ID'],
+                           client_secret = os.environ.get('FROST_CLIENT_SECRET'))
+    if os.path.isfile('credentials.txt'):
+        return read_credentials(os.path.abspath('credentials.txt'))
+    raise CredentialsError('You need to set FROST_CLIENT_ID or have a credentials.txt with ' +\
+                           'your credentials in it, see README.md for details')
+
+
+default_clients = {}
+
+
+def shared_client(*,
+                  credentials: Credentials = None,
+                  path: str = None) -> 'API':
+    """
+    Description:
+        Returns one shared API client per set of credentials, so many 
+        Stations instances and tasks reuse the same authenticated session, 
+        cache and statistics
+    Args:
+        credentials:    credentials to use as they are
+        path:           path to a credentials file
+    """
+    credentials = load_credentials(credentials = credentials, path = path)
+    if credentials not in default_clients:
+        default_clients[credentials] = API(credentials = credentials)
+    return default_clients[credentials]
+
+
+class Connection:
+    """
+    Description:
+        Holds the requests session of an API client. The session is created 
+        lazily in each process, so a client inherited through fork or 
+        unpickled in a worker process never reuses the sockets of its parent.
+    """
+    def __init__(self,
+                 auth: requests.auth.AuthBase) -> None:
+        """
+        Description:
+            Class instance initialization
+        Args:
+            auth:   authentication used for every request of the session
+        """
+        self.auth = auth
+        self.pid = None
+        self.current = None
+
+    @property
+    def session(self) -> requests.Session:
+        """
+        Description:
+            The session of the current process
+        """
+        if self.pid != os.getpid():
+            self.current = requests.Session()
+            self.current.auth = self.auth
+            self.pid = os.getpid()
+        return self.current
+
+    def __getstate__(self) -> dict:
+        return {'auth': self.auth}
+
+    def __setstate__(self,
+                     state: dict) -> None:
+        self.__init__(state['auth'])
+
+
+class AdaptiveLimiter:
+    """
+    Description:
+        AIMD limit on the number of requests in flight. Every successful 
+        request raises the limit by increase/limit, i.e. by about increase 
+        per round trip of a full window. Throttled (429) and failed requests, 
+        and requests slower than tolerance times the baseline latency of 
+        their kind, cut the limit by the backoff factor. Only 200 responses 
+        are timed, and they are compared within the same endpoint and body 
+        size (within a factor of 4), so a year of observations is not 
+        measured against a quick 404 or a latest call. The baseline is the 
+        lowest smoothed latency of its kind, which drifts up towards the 
+        smoothed latency so one fast spell does not pin it forever. Callers 
+        beyond the limit wait in acquire(). Like Connection, the lock and the in-flight 
+        counts belong to one process and are reset in a process inherited 
+        through fork, where another thread may have held the lock.
+    """
+    def __init__(self,
+                 *,
+                 initial: int = 8,
+                 minimum: int = 1,
+                 maximum: int = 64,
+                 increase: float = 1.0,
+                 backoff: float = 0.5,
+                 tolerance: float = 2.0,
+                 smoothing: float = 0.2,
+                 drift: float = 0.01) -> None:
+        """
+        Description:
+            Class instance initialization
+        Args:
+            initial:    limit to start with
+            minimum:    lowest limit
+            maximum:    highest limit
+            increase:   additive increase per window of successful requests
+            backoff:    multiplicative decrease on throttling or errors
+            tolerance:  smoothed latency over tolerance times the baseline 
+                        latency counts as congestion
+            smoothing:  weight of the newest latency in the moving average
+            drift:      weight of the smoothed latency in the baseline, so 
+                        the baseline forgets a fast spell after about 
+                        1/drift requests
+        """
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.backoff = backoff
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+        self.drift = drift
+        self.current = float(initial)
+        self.in_flight = 0
+        self.queue_depth = 0
+        # Smoothed and baseline latency by endpoint and body size, see release()
+        self.latency = {}
+        self.min_latency = {}
+        self.stats = {'requests': 0, 'throttled': 0, 'errors': 0, 'slow': 0}
+        self.pid = None
+        self.current_condition = None
+
+    @property
+    def condition(self) -> threading.Condition:
+        """
+        Description:
+            The lock of the current process
+        """
+        if self.pid != os.getpid():
+            self.current_condition = threading.Condition()
+            self.in_flight = 0
+            self.queue_depth = 0
+            self.pid = os.getpid()
+        return self.current_condition
+
+    @property
+    def limit(self) -> int:
+        """
+        Description:
+            Current number of requests allowed in flight
+        """
+        return max(int(self.current), self.minimum)
+
+    def acquire(self) -> None:
+        """
+        Description:
+            Waits until a request may be sent
+        """
+        with self.condition:
+            self.queue_depth += 1
+            while self.in_flight >= self.limit:
+                self.condition.wait()
+            self.queue_depth -= 1
+            self.in_flight += 1
+
+    def release(self,
+                latency: float,
+                status_code: int = None,
+                endpoint: str = None,
+                size: int = 0) -> None:
+        """
+        Description:
+            Records a finished request and adjusts the limit
+        Args:
+            latency:        duration of the request in s
+            status_code:    HTTP status code, None if the request failed
+            endpoint:       URL path of the request
+            size:           body size in bytes, latencies are only 
+                            compared within the same endpoint and size
+        """
+        with self.condition:
+            self.in_flight -= 1
+            self.stats['requests'] += 1
+            if status_code == 429:
+                self.stats['throttled'] += 1
+                self.current = max(self.current*self.backoff, self.minimum)
+            elif status_code is None or status_code >= 500:
+                self.stats['errors'] += 1
+                self.current = max(self.current*self.backoff, self.minimum)
+            elif status_code != 200:
+                # Answered without a body worth timing, e.g. 404 for no data or 304
+                self.current = min(self.current + self.increase/self.current, self.maximum)
+            else:
+                kind = (endpoint, size.bit_length()//2)
+                smoothed = self.latency.get(kind, latency)
+                smoothed += self.smoothing*(latency - smoothed)
+                baseline = self.min_latency.get(kind, smoothed)
+                baseline = min(baseline + self.drift*(smoothed - baseline), smoothed)
+                self.latency[kind] = smoothed
+                self.min_latency[kind] = baseline
+                if smoothed > self.tolerance*baseline:
+                    self.stats['slow'] += 1
+                    self.current = max(self.current*self.backoff, self.minimum)
+                    # Reset the average so one slow spell only backs off once
+                    self.latency[kind] = baseline
+                else:
+                    self.current = min(self.current + self.increase/self.current, self.maximum)
+            self.condition.notify_all()
+
+    def __getstate__(self) -> dict:
+        state = dict(self.__dict__)
+        state['pid'] = None
+        state['current_condition'] = None
+        return state
+
+
+# Client of the worker processes started by API.map_observations()
+worker_client = None
+
+
+def set_worker_client(api: 'API') -> None:
+    """
+    Description:
+        Process pool initializer that keeps the unpickled client for the tasks
+    Args:
+        api:    the client to use in this worker process
+    """
+    global worker_client
+    worker_client = api
+
+
+def observations_task(query: dict) -> (int, 'response json'):
+    """
+    Description:
+        Process pool task running one get_observations() call
+    Args:
+        query:  keyword arguments of get_observations()
+    """
+    return worker_client.get_observations(**query)
+
+
+class CacheEntry(typing.NamedTuple):
+    expires: float
+    etag: str
+    last_modified: str
+    status_code: int
+    json: dict
+
+
 class API:
-    def __init__(self) -> None:
+    # State that is shared with the API instance given as client
+    shared = ['base_url', 'headers', 'api_version', 'spool_threshold', 'auth', 'connection',
+              'limiter', 'timeout', 'cache_ttl', 'cache_size', 'cache', 'cache_stats',
+              'transfer_stats',
+              'measure_projection']
+
+    def __init__(self,
+                 *,
+                 credentials: Credentials = None,
+                 credentials_path: str = None,
+                 client: 'API' = None) -> None:
+        """
+        Description:
+            Class instance initialization. Credentials are resolved with 
+            load_credentials() unless an existing client is given, in which 
+            case its session, cache and settings are shared.
+        Args:
+            credentials:        credentials to use as they are
+            credentials_path:   path to a credentials file
+            client:             API instance to share the session with
+        """
+        self.stations = {}
+        if client is not None:
+            for name in self.shared:
+                setattr(self, name, getattr(client, name))
+            return
+
+        credentials = load_credentials(credentials = credentials, path = credentials_path)
         self.base_url = 'https://frost.met.no/'
-        self.headers = {}
+        self.headers = {'Accept-Encoding': ACCEPT_ENCODING}
         self.api_version = '0'
-        secret = configparser.ConfigParser()
-        if os.path.isfile('credentials.txt'):
-            secret.read('credentials.txt')
-            if 'xxxxxxxx' in secret['SECRET']['client_id']:
-                print('You need to change from the default credentials in credentials.txt')
-                sys.exit(1)
-        else:
-            print('You need a credentials.txt with your ' +\
-                  'credentials in it, see README.md for details')
-            with open('credentials.txt', 'w') as secrets:
-                secret['SECRET'] = {'client_id' : 'xxxxxxxx-xxxx-xxxx-xxxx-xxxxxxxxxxxx',\
-                                    'client_secret' : 'xxxxxxxx-xxxx-xxxx-xxxx-xxxxxxxxxxxx'}
-                secret.write(secrets)
-            sys.exit(1)
-
-        self.auth = requests.auth.HTTPBasicAuth(secret['SECRET']['client_id'],'')
-        self.stations = {}
+        self.spool_threshold = None # bytes
+        self.auth = requests.auth.HTTPBasicAuth(credentials.client_id, '')
+        self.connection = Connection(self.auth)
+        self.limiter = AdaptiveLimiter()
+        self.timeout = 60.0 # s, for connecting and between bytes of the body
+        self.cache_ttl = 3600.0 # s
+        self.cache_size = 256 # responses, the least recently used are evicted
+        self.cache = collections.OrderedDict()
+        self.cache_stats = {'hits': 0, 'misses': 0, 'revalidations': 0, 'not_modified': 0}
+        self.transfer_stats = {}
+        self.measure_projection = False
+
+    @property
+    def session(self) -> requests.Session:
+        """
+        Description:
+            The requests session of the current process, see Connection
+        """
+        return self.connection.session
+
+    def __getstate__(self) -> dict:
+        """
+        Description:
+            Pickles the settings and results but not the cached responses, 
+            so clients are cheap to send to worker processes
+        """
+        state = dict(self.__dict__)
+        state['cache'] = collections.OrderedDict()
+        return state
 
     def get_elements_code_tables(self,
                                  *,
@@ -68,7 +677,7 @@ class API:
         url = self.base_url + f'elements/codeTables/v{self.api_version}.jsonld?'
 
         response = self.get_response(url + query_parameters)
-        return response.status_code, response.json() 
+        return self.read_json(response)
 
     def get_elements(self,
                      *,
@@ -164,8 +773,7 @@ class API:
         query_parameters = self.query_parameters(input_vars)
         url = self.base_url + f'elements/v{self.api_version}.jsonld?'
 
-        response = self.get_response(url + query_parameters)
-        return response.status_code, response.json() 
+        return self.get_cached(url + query_parameters)
 
     def get_sources(self,
                     *,
@@ -255,8 +863,7 @@ class API:
         query_parameters = self.query_parameters(input_vars)
         url = self.base_url + f'sources/v{self.api_version}.jsonld?'
 
-        response = self.get_response(url + query_parameters)
-        return response.status_code, response.json() 
+        return self.get_cached(url + query_parameters)
      
     def get_locations(self,
                       *,
@@ -289,7 +896,7 @@ class API:
         url = self.base_url + f'locations/v{self.api_version}.jsonld?'
 
         response = self.get_response(url + query_parameters)
-        return response.status_code, response.json() 
+        return self.read_json(response)
 
     def get_records(self,
                     *,
@@ -337,7 +944,7 @@ class API:
         url = self.base_url + f'records/countyExtremes/v{self.api_version}.jsonld?'
 
         response = self.get_response(url + query_parameters)
-        return response.status_code, response.json() 
+        return self.read_json(response)
 
     def get_observations_available_time_series(self,
                                                *,
@@ -423,7 +1030,7 @@ class API:
         url = self.base_url + f'observations/availableTimeSeries/v{self.api_version}.jsonld?'
 
         response = self.get_response(url + query_parameters)
-        return response.status_code, response.json() 
+        return self.read_json(response)
 
     def get_observations_quality(self,
                                  flags: str,
@@ -449,7 +1056,7 @@ class API:
 
 
         response = self.get_response(url + query_parameters)
-        return response.status_code, response.json() 
+        return self.read_json(response)
 
     def get_observations_available_quality_codes(self,
                                                  *,
@@ -470,7 +1077,7 @@ class API:
         url = self.base_url + f'observations/availableQualityCodes/v{self.api_version}.jsonld?'
         
         response = self.get_response(url + query_parameters)
-        return response.status_code, response.json() 
+        return self.read_json(response)
 
     def get_observations(self,
                          sources: str,
@@ -548,7 +1155,105 @@ class API:
         url = self.base_url + f'observations/v{self.api_version}.jsonld?'
 
         response = self.get_response(url + query_parameters)
-        return response.status_code, response.json() 
+        return self.read_json(response)
+
+    def get_observations_columns(self,
+                                 queries: list,
+                                 *,
+                                 max_workers: int = None) -> list:
+        """
+        Description:
+            Fetches many observation queries concurrently and hands each raw 
+            response body to a process pool for decoding and flattening as 
+            soon as it arrives, so that the CPU-bound part is not serialised 
+            by the GIL. At most twice the number of workers queries are 
+            being fetched or decoded at a time, so bodies do not pile up in 
+            memory when fetching is faster than decoding. The workers send 
+            the columns back dictionary-encoded, see flatten_observations(). 
+            Returns a list of (status code, columns) in the order of the 
+            queries, see observation_columns() for the columns. Failed 
+            queries get None as columns.
+        Args:
+            queries:        list of dicts with the keyword arguments of 
+                            get_observations()
+            max_workers:    number of worker processes, defaults to the 
+                            number of cores
+        """
+        url = self.base_url + f'observations/v{self.api_version}.jsonld?'
+        window = 2*(max_workers or os.cpu_count() or 1)
+        results = [None]*len(queries)
+        waiting = iter(enumerate(queries))
+        # Queries being fetched or decoded, by future
+        fetching, decoding = {}, {}
+        with concurrent.futures.ThreadPoolExecutor(window) as threads, \
+             concurrent.futures.ProcessPoolExecutor(max_workers) as processes:
+            while True:
+                free = window - len(fetching) - len(decoding)
+                for i, query in itertools.islice(waiting, free):
+                    future = threads.submit(self.get_response, url + self.query_parameters(query))
+                    fetching[future] = i
+                if not fetching and not decoding:
+                    break
+                done, _ = concurrent.futures.wait([*fetching, *decoding],
+                                                  return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    if future in decoding:
+                        i = decoding.pop(future)
+                        results[i] = (results[i][0], decode_columns(future.result()))
+                        continue
+                    i = fetching.pop(future)
+                    response = future.result()
+                    results[i] = (response.status_code, None)
+                    if response.status_code == 200:
+                        content = response.content
+                        if isinstance(content, mmap.mmap):
+                            # Memory maps cannot be sent to other processes
+                            content = content[:]
+                        decoding[processes.submit(flatten_observations, content)] = i
+                        del content
+                    del response
+        return results
+
+    def map_observations(self,
+                         sources: list,
+                         elements: list,
+                         reference_time: str,
+                         *,
+                         sources_per_request: int = 50,
+                         elements_per_request: int = None,
+                         max_workers: int = None,
+                         **kwargs) -> list:
+        """
+        Description:
+            Runs a sources x elements sweep of get_observations() calls in a 
+            process pool. The client is handed to each worker process once, 
+            pickled or inherited through fork, and each worker creates its 
+            own session and limiter lock. Returns a list of (status 
+            code, response json), one per request, in the order of the 
+            source chunks and, within those, the element chunks.
+        Args:
+            sources:                station IDs
+            elements:               elements
+            reference_time:         see get_observations()
+            sources_per_request:    number of sources in each request
+            elements_per_request:   number of elements in each request, all 
+                                    in one request by default
+            max_workers:            number of worker processes, defaults to 
+                                    the number of cores
+            kwargs:                 other keyword arguments of 
+                                    get_observations()
+        """
+        elements_per_request = elements_per_request or len(elements) or 1
+        queries = [{'sources': ','.join(sources[i:i + sources_per_request]),
+                    'reference_time': reference_time,
+                    'elements': ','.join(elements[j:j + elements_per_request]),
+                    **kwargs}
+                   for i in range(0, len(sources), sources_per_request)
+                   for j in range(0, len(elements), elements_per_request)]
+        with concurrent.futures.ProcessPoolExecutor(max_workers,
+                                                    initializer = set_worker_client,
+                                                    initargs = (self,)) as processes:
+            return list(processes.map(observations_task, queries))
 
     def get_climate_normals(self,
                             sources: str,
@@ -575,7 +1280,7 @@ class API:
         url = self.base_url + f'climatenormals/v{self.api_version}.jsonld?'
 
         response = self.get_response(url + query_parameters)
-        return response.status_code, response.json() 
+        return self.read_json(response)
 
     def get_climate_normals_available(self,
                                       *,
@@ -614,8 +1319,7 @@ class API:
         query_parameters = self.query_parameters(input_vars)
         url = self.base_url + f'climatenormals/available/v{self.api_version}.jsonld?'
 
-        response = self.get_response(url + query_parameters)
-        return response.status_code, response.json() 
+        return self.get_cached(url + query_parameters)
 
     def get_frequencies_rainfall(self,
                                  *,
@@ -668,7 +1372,7 @@ class API:
         url = self.base_url + f'frequencies/rainfall/v{self.api_version}.jsonld?'
 
         response = self.get_response(url + query_parameters)
-        return response.status_code, response.json() 
+        return self.read_json(response)
         
     def get_frequencies_rainfall_available_sources(self,
                                                    *,
@@ -704,24 +1408,238 @@ class API:
         url = self.base_url + f'frequencies/rainfall/availableSources/v{self.api_version}.jsonld?'
 
         response = self.get_response(url + query_parameters)
-        return response.status_code, response.json() 
+        return self.read_json(response)
 
     def get_response(self,
-                     url: str) -> 'GET response':
+                     url: str,
+                     *,
+                     headers: dict = None) -> 'GET response':
         """
         Description:
             Calls the API and checks if the response was successfull
         Args:
-            url:    The url which is to be used in the GET request
+            url:        The url which is to be used in the GET request
+            headers:    Extra headers for this request only, e.g. 
+                        conditional request headers
+        """
+        headers = {**self.headers, **(headers or {})}
+        stream = self.spool_threshold is not None
+        if stream and orjson is None:
+            warnings.warn('Spooling large bodies needs orjson, without it the body would be ' +\
+                          'copied to the heap twice when parsed; reading it in memory instead')
+            stream = False
+        self.limiter.acquire()
+        start = time.perf_counter()
+        status_code = None
+        size = 0
+        try:
+            with self.session.get(url, headers=headers, stream=stream,
+                                  timeout=self.timeout) as response:
+                status_code = response.status_code
+                if stream:
+                    self.spool(response)
+                if status_code == 200:
+                    size = len(response.content)
+                if response.status_code == 304:
+                    print(f'Response code: {response.status_code}, GET {url} (not modified)')
+                elif not response.status_code == 200:
+                    print(f'Response code {response.status_code}, from url {url}')
+                    try:
+                        print(f'Error: {json_loads(response.content)["error"]}')
+                    except (ValueError, KeyError):
+                        print(f'Error: {response.reason}')
+                    #raise AssertionError()
+                else:
+                    print(f'Response code: {response.status_code}, GET {url}')
+                return response
+        finally:
+            self.limiter.release(time.perf_counter() - start, status_code,
+                                 urllib.parse.urlsplit(url).path, size)
+
+    def spool(self,
+              response: 'GET response') -> None:
+        """
+        Description:
+            Reads the body of a streamed response. Bodies larger than 
+            spool_threshold bytes are written to a temporary file which is 
+            memory-mapped instead of being kept on the heap, and 
+            response.content then refers to the memory map. Only used when 
+            orjson is installed, since it is the only parser that reads the 
+            memory map without copying it, see json_loads().
+        Args:
+            response:   streamed response from session.get
         """
-        with requests.get(url, headers=self.headers, auth=self.auth) as response:
-            if not response.status_code == 200:
-                print(f'Response code {response.status_code}, from url {url}')
-                print(f'Error: {response.json()["error"]}')
-                #raise AssertionError()
+        body = bytearray()
+        spooled = None
+        for chunk in response.iter_content(chunk_size=1 << 16):
+            if spooled is None and len(body) + len(chunk) > self.spool_threshold:
+                spooled = tempfile.TemporaryFile()
+                spooled.write(body)
+                body = None
+            if spooled is None:
+                body += chunk
             else:
-                print(f'Response code: {response.status_code}, GET {url}')
-            return response
+                spooled.write(chunk)
+
+        if spooled is None:
+            content = bytes(body)
+        else:
+            spooled.flush()
+            content = mmap.mmap(spooled.fileno(), 0, access=mmap.ACCESS_READ)
+            spooled.close()
+        # Same bookkeeping as requests does when it reads the body itself
+        response._content = content
+        response._content_consumed = True
+
+    def read_json(self,
+                  response: 'GET response') -> (int, 'response json'):
+        """
+        Description:
+            Decodes the response body and records how much was transferred
+        Args:
+            response:   response from get_response()
+        """
+        response_json = json_loads(response.content)
+        self.record_transfer(response, response_json)
+        return response.status_code, response_json
+
+    def record_transfer(self,
+                        response: 'GET response',
+                        response_json: dict) -> None:
+        """
+        Description:
+            Keeps byte and record counts per endpoint in transfer_stats. 
+            Calls without a fields parameter give the size of a full record, 
+            and calls with one are reported with the bytes saved compared to 
+            full records. Savings are only known once the endpoint had a 
+            call without fields. With measure_projection set, the first 
+            projected call of an endpoint without one is repeated without 
+            fields to measure the baseline. That downloads the full records 
+            once, so it is off by default, and its bytes are counted like 
+            any other call.
+        Args:
+            response:       response from get_response()
+            response_json:  the decoded response body
+        """
+        url = urllib.parse.urlsplit(response.url)
+        projected = 'fields' in urllib.parse.parse_qs(url.query)
+        size = len(response.content)
+        records = len(response_json.get('data', []))
+
+        stats = self.transfer_stats.setdefault(url.path, {'calls': 0,
+                                                          'bytes': 0,
+                                                          'full_bytes': 0,
+                                                          'full_records': 0,
+                                                          'saved_bytes': 0,
+                                                          'baseline_measured': False})
+        stats['calls'] += 1
+        stats['bytes'] += size
+        if not projected:
+            stats['full_bytes'] += size
+            stats['full_records'] += records
+            return
+
+        if self.measure_projection and not stats['full_records'] and \
+           not stats['baseline_measured']:
+            stats['baseline_measured'] = True
+            query = '&'.join(f'{key}={value}'
+                             for key, value in urllib.parse.parse_qsl(url.query)
+                             if key != 'fields')
+            try:
+                baseline = self.get_response(f'{url.scheme}://{url.netloc}{url.path}?{query}')
+            except requests.RequestException as error:
+                # The projected call itself succeeded, only the estimate is lost
+                print(f'Baseline request failed: {error}')
+                baseline = None
+            if baseline is not None:
+                stats['calls'] += 1
+                stats['bytes'] += len(baseline.content)
+                if baseline.status_code == 200:
+                    stats['full_bytes'] += len(baseline.content)
+                    stats['full_records'] += len(json_loads(baseline.content).get('data', []))
+
+        if stats['full_records']:
+            bytes_per_record = stats['full_bytes']/stats['full_records']
+            saved = max(int(records*bytes_per_record) - size, 0)
+            stats['saved_bytes'] += saved
+            print(f'Projection saved ~{saved} bytes, GET {url.path}')
+
+    def get_cached(self,
+                   url: str) -> (int, 'response json'):
+        """
+        Description:
+            GET with a time-to-live cache for metadata that rarely changes. 
+            The ETag and Last-Modified validators of each response are 
+            stored, and an expired entry is revalidated with a conditional 
+            request. A 304 response refreshes the TTL and reuses the already 
+            parsed json without downloading the body again. At most 
+            cache_size responses are kept, the least recently used are 
+            evicted. Cached json is shared by every caller of the same url 
+            and must not be modified.
+        Args:
+            url:    The url which is to be used in the GET request
+        """
+        now = time.monotonic()
+        entry = self.cache.get(url)
+        if entry and entry.expires > now:
+            self.cache_stats['hits'] += 1
+            self.touch(url, entry)
+            return entry.status_code, entry.json
+
+        headers = {}
+        if entry:
+            self.cache_stats['revalidations'] += 1
+            if entry.etag:
+                headers['If-None-Match'] = entry.etag
+            if entry.last_modified:
+                headers['If-Modified-Since'] = entry.last_modified
+
+        response = self.get_response(url, headers=headers)
+        if entry and response.status_code == 304:
+            self.cache_stats['not_modified'] += 1
+            self.touch(url, entry._replace(expires=now + self.cache_ttl))
+            return entry.status_code, entry.json
+
+        self.cache_stats['misses'] += 1
+        status_code, response_json = self.read_json(response)
+        if response.status_code == 200:
+            self.touch(url, CacheEntry(expires = now + self.cache_ttl,
+                                       etag = response.headers.get('ETag'),
+                                       last_modified = response.headers.get('Last-Modified'),
+                                       status_code = response.status_code,
+                                       json = response_json))
+        return response.status_code, response_json
+
+    def touch(self,
+              url: str,
+              entry: CacheEntry) -> None:
+        """
+        Description:
+            Stores a cache entry as the most recently used one and evicts 
+            the least recently used entries beyond cache_size
+        Args:
+            url:    key of the entry
+            entry:  the entry
+        """
+        self.cache.pop(url, None)
+        self.cache[url] = entry
+        while len(self.cache) > self.cache_size:
+            try:
+                self.cache.popitem(last=False)
+            except KeyError:
+                # Emptied by another thread
+                break
+
+    @property
+    def revalidation_hit_rate(self) -> float:
+        """
+        Description:
+            Fraction of conditional requests that were answered with 304 Not 
+            Modified
+        """
+        if not self.cache_stats['revalidations']:
+            return 0.0
+        return self.cache_stats['not_modified']/self.cache_stats['revalidations']
 
     def query_parameters(self, input_vars) -> str:
         """
@@ -774,7 +1692,7 @@ class API:
                            end_time.strftime('%Y-%m-%dT%H:%M:%S.000Z')
 
         if seperation:
-            time_string += '/P{seperation}'
+            time_string += f'/P{seperation}'
 
         return time_string
 
@@ -799,41 +1717,267 @@ class API:
         status_code, response_json = self.get_frequencies_rainfall_available_sources()
 
 
-class Station(typing.NamedTuple):
-    station_id: str
-    name: str
-    coords: list
-    valid_from: str
-    municipality: str
-    distance: float
-    available: list 
+def square_polygon(latitude: float,
+                   longitude: float,
+                   length_of_square: float) -> tuple:
+    """
+    Description:
+        Bounding box (west, south, east, north) in WGS84 degrees of a square 
+        around a point
+    Args:
+        latitude:           latitude coordinate of the centre in WGS84
+        longitude:          longitude coordinate of the centre in WGS84
+        length_of_square:   length of side of the square in km
+    """
+    one_deg_lat = 110.574 # km
+    one_deg_lon = 111.320*math.cos(math.radians(latitude)) # km
 
+    length_half_side = length_of_square/2
+    length_to_corner_lat = length_half_side/one_deg_lat
+    length_to_corner_lon = length_half_side/one_deg_lon
 
-class Stations(API):
+    return (longitude - length_to_corner_lon, latitude - length_to_corner_lat,
+            longitude + length_to_corner_lon, latitude + length_to_corner_lat)
+
+
+def polygon_wkt(bbox: tuple) -> str:
     """
     Description:
-        Finds all stations within a square of chosen size from a point with
-        WGS84 coordinates and collects available observational data from each
-        station
+        WKT POLYGON of a bounding box, for the geometry parameter
+    Args:
+        bbox:   (west, south, east, north) in WGS84 degrees
     """
-    def __init__(self,
-                 latitude: float,
-                 longitude: float,
-                 *,
-                 length_of_square: float = 10.0) -> None:
-        """
-        Description:
-            Class instance initialization
-        Args:
-            latitude:           latitudal coordinate
-            longitude:          longitudal coordinate
+    west, south, east, north = bbox
+    return f'POLYGON(({west} {south}, {east} {south}, {east} {north}, ' +\
+           f'{west} {north}, {west} {south}))'
+
+
+def point_in_polygon(longitude: float,
+                     latitude: float,
+                     polygon: list) -> bool:
+    """
+    Description:
+        Ray casting test of whether a point is inside a polygon
+    Args:
+        longitude:  longitude of the point
+        latitude:   latitude of the point
+        polygon:    list of (longitude, latitude) vertices
+    """
+    inside = False
+    for (x0, y0), (x1, y1) in zip(polygon, polygon[1:] + polygon[:1]):
+        if (y0 > latitude) != (y1 > latitude):
+            if longitude < x0 + (latitude - y0)*(x1 - x0)/(y1 - y0):
+                inside = not inside
+    return inside
+
+
+def tile_intersects(bbox: tuple,
+                    polygon: list) -> bool:
+    """
+    Description:
+        Whether a tile and a polygon overlap, that is if a corner of the tile 
+        is in the polygon, a vertex of the polygon is in the tile or their 
+        edges cross
+    Args:
+        bbox:       tile as (west, south, east, north)
+        polygon:    list of (longitude, latitude) vertices
+    """
+    west, south, east, north = bbox
+    corners = [(west, south), (east, south), (east, north), (west, north)]
+    if any(point_in_polygon(x, y, polygon) for x, y in corners):
+        return True
+    if any(west <= x <= east and south <= y <= north for x, y in polygon):
+        return True
+
+    def side(p, q, r):
+        return (q[0] - p[0])*(r[1] - p[1]) - (q[1] - p[1])*(r[0] - p[0])
+
+    def crosses(a, b, c, d):
+        return side(a, b, c)*side(a, b, d) < 0 and side(c, d, a)*side(c, d, b) < 0
+
+    edges = list(zip(polygon, polygon[1:] + polygon[:1]))
+    return any(crosses(a, b, c, d)
+               for a, b in zip(corners, corners[1:] + corners[:1])
+               for c, d in edges)
+
+
+def tiles(bbox: tuple,
+          tile_size: float,
+          polygon: list = None) -> list:
+    """
+    Description:
+        Covers a bounding box with tiles of about tile_size x tile_size km, 
+        keeping only the tiles that overlap the polygon if one is given
+    Args:
+        bbox:       (west, south, east, north) in WGS84 degrees
+        tile_size:  length of the side of each tile in km
+        polygon:    list of (longitude, latitude) vertices
+    """
+    west, south, east, north = bbox
+
+    def count(length, step):
+        # Rounding errors must not add a sliver tile
+        return max(math.ceil(length/step - 1e-9), 1)
+
+    rows = count(north - south, tile_size/110.574)
+    result = []
+    for row in range(rows):
+        row_south = south + (north - south)*row/rows
+        row_north = south + (north - south)*(row + 1)/rows
+        middle = math.radians((row_south + row_north)/2)
+        columns = count(east - west, tile_size/(111.320*max(math.cos(middle), 1e-6)))
+        for column in range(columns):
+            tile = (west + (east - west)*column/columns, row_south,
+                    west + (east - west)*(column + 1)/columns, row_north)
+            if polygon is None or tile_intersects(tile, polygon):
+                result.append(tile)
+    return result
+
+
+class DiscoveryError(Exception):
+    """
+    Raised by discover_sources() when tiles fail. The finished tiles are 
+    cached, failed holds the status code by tile geometry and sources the 
+    partial result.
+    """
+    def __init__(self,
+                 failed: dict,
+                 sources: dict) -> None:
+        super().__init__(f'{len(failed)} tiles failed with status codes ' +\
+                         ', '.join(sorted({str(status_code) for status_code in failed.values()})))
+        self.failed = failed
+        self.sources = sources
+
+
+def discover_sources(api: 'API',
+                     *,
+                     bbox: tuple = None,
+                     polygon: list = None,
+                     tile_size: float = 50.0,
+                     workers: int = 8,
+                     cache_path: str = None,
+                     fields: str = None,
+                     types: str = 'SensorSystem') -> dict:
+    """
+    Description:
+        Finds all sources in a bounding box or polygon by covering it with 
+        tiles that are queried concurrently with get_sources(). Sources on 
+        tile boundaries are deduplicated by ID. With a cache_path, finished 
+        tiles are appended to a JSON lines file, so an interrupted discovery 
+        continues where it stopped. Returns the sources by ID, and raises 
+        DiscoveryError when any tile fails, so a partial result is never 
+        taken for a complete one.
+    Args:
+        api:        API instance used for the requests
+        bbox:       (west, south, east, north) in WGS84 degrees, defaults to 
+                    the bounding box of the polygon
+        polygon:    list of (longitude, latitude) vertices, only sources 
+                    inside it are returned
+        tile_size:  length of the side of each tile in km
+        workers:    number of concurrent requests
+        cache_path: JSON lines file with the results of finished tiles
+        fields:     fields parameter of get_sources(), defaults to the 
+                    fields Station is built from
+        types:      types parameter of get_sources()
+    """
+    if bbox is None:
+        bbox = (min(x for x, y in polygon), min(y for x, y in polygon),
+                max(x for x, y in polygon), max(y for x, y in polygon))
+    if fields is None:
+        fields = projection(Station.source_attributes, STATION_FIELDS)
+
+    done = {}
+    if cache_path and os.path.isfile(cache_path):
+        with open(cache_path) as cache:
+            for line in cache:
+                tile = json.loads(line)
+                done[tile['geometry']] = tile['data']
+
+    def query(geometry):
+        status_code, response_json = api.get_sources(geometry = geometry,
+                                                     fields = fields,
+                                                     types = types)
+        if status_code == 200:
+            return geometry, response_json['data']
+        # Frost answers 404 when there are no sources in the geometry
+        return geometry, [] if status_code == 404 else status_code
+
+    geometries = [polygon_wkt(tile) for tile in tiles(bbox, tile_size, polygon)]
+    failed = {}
+    with concurrent.futures.ThreadPoolExecutor(workers) as threads:
+        for geometry, data in threads.map(query, [geometry for geometry in geometries
+                                                  if geometry not in done]):
+            if not isinstance(data, list):
+                failed[geometry] = data
+                continue
+            done[geometry] = data
+            if cache_path:
+                with open(cache_path, 'a') as cache:
+                    cache.write(json.dumps({'geometry': geometry, 'data': data}) + '\n')
+
+    sources = {}
+    for geometry in geometries:
+        for data in done.get(geometry, []):
+            coordinates = data.get('geometry', {}).get('coordinates')
+            if polygon and coordinates and \
+               not point_in_polygon(coordinates[0], coordinates[1], polygon):
+                continue
+            sources.setdefault(data['id'], data)
+    if failed:
+        raise DiscoveryError(failed, sources)
+    return sources
+
+
+class Station(typing.NamedTuple):
+    station_id: str
+    name: str
+    coords: list
+    valid_from: str
+    municipality: str
+    distance: float
+    available: list 
+
+    # Attributes read directly from /sources, see STATION_FIELDS
+    source_attributes = ['station_id', 'name', 'coords', 'valid_from', 'municipality']
+
+
+class Stations(API):
+    """
+    Description:
+        Finds all stations within a square of chosen size from a point with
+        WGS84 coordinates and collects available observational data from each
+        station
+    """
+    def __init__(self,
+                 latitude: float,
+                 longitude: float,
+                 *,
+                 length_of_square: float = 10.0,
+                 tile_size: float = None,
+                 store: 'ObservationStore' = None,
+                 client: API = None) -> None:
+        """
+        Description:
+            Class instance initialization
+        Args:
+            latitude:           latitudal coordinate
+            longitude:          longitudal coordinate
             length_of_square:   length of side of square in km
+            tile_size:          if given, the square is searched in tiles 
+                                of this size in km, see discover_sources(). 
+                                Failed tiles raise DiscoveryError
+            store:              ObservationStore that observational_data() 
+                                reads from when it covers the request
+            client:             API instance to share the session with, 
+                                defaults to shared_client()
         """
-        super().__init__()
+        super().__init__(client = client or shared_client())
         self.stations = {}
         self.latitude = latitude
         self.longitude = longitude
         self.length_of_square = length_of_square
+        self.tile_size = tile_size
+        self.store = store
         self.find_stations()
         self.has()
 
@@ -878,16 +2022,25 @@ class Stations(API):
             length_of_square:   length of side of square to search for stations
         """
         self.station_ids = {}
-        polygon = self.calculate_polygon()
-        status_code, response_json = self.get_sources(geometry = f'POLYGON(({polygon}))')
-        for data in response_json['data']:
+        if self.tile_size:
+            bbox = square_polygon(self.latitude, self.longitude, self.length_of_square)
+            sources = list(discover_sources(self, bbox = bbox,
+                                            tile_size = self.tile_size).values())
+        else:
+            polygon = self.calculate_polygon()
+            fields = projection(Station.source_attributes, STATION_FIELDS)
+            status_code, response_json = self.get_sources(geometry = f'POLYGON(({polygon}))',
+                                                          fields = fields)
+            sources = response_json['data']
+        for data in sources:
             station_id = data['id']
             name = data['name']
             coords = [data['geometry']['coordinates'][1], data['geometry']['coordinates'][0]]
             valid_from = data['validFrom']
             municipality = data['municipality']
             distance = self.distance(coords=coords)
-            rs, rs_json = self.get_observations_available_time_series(sources=station_id)
+            rs, rs_json = self.get_observations_available_time_series(
+                sources=station_id, fields=projection(TIME_SERIES_FIELDS))
             if rs != 200:
                 available = []
             else:
@@ -912,22 +2065,10 @@ class Stations(API):
             longitude:          longitude coordinate of wanted point in WGS84
             length_of_square:   length of side of square to search for stations
         """
-        one_deg_lat = 110.574 # km
-        one_deg_lon = 111.320*math.cos(math.radians(self.latitude)) # km
-
-        length_half_side = self.length_of_square/2
-
-        length_to_corner_lat = length_half_side/one_deg_lat
-        length_to_corner_lon = length_half_side/one_deg_lon
-
-        north = self.latitude + length_to_corner_lat
-        south = self.latitude - length_to_corner_lat
-        east = self.longitude + length_to_corner_lon
-        west = self.longitude - length_to_corner_lon
-
-        return f'{self.longitude} {north}, {self.longitude} {south},' +\
-               f' {east} {self.latitude}, {west} {self.latitude},'+\
-               f' {self.longitude} {north}'
+        west, south, east, north = square_polygon(self.latitude, self.longitude,
+                                                  self.length_of_square)
+        return f'{west} {south}, {east} {south}, {east} {north},' +\
+               f' {west} {north}, {west} {south}'
 
     def distance(self, coords: list) -> None:
         """
@@ -951,7 +2092,8 @@ class Stations(API):
                            repeat: int = 0,
                            seperation: str = None,
                            start_time: 'datetime.datetime' = None,
-                           end_time: 'datetime.datetime' = None) -> None:
+                           end_time: 'datetime.datetime' = None,
+                           resolution: str = None) -> (int, 'response json'):
         """
         Description:
             A simplified observations call for one station. For a fully
@@ -964,15 +2106,76 @@ class Stations(API):
                         duration between each interval
             start_time: starting time of observational data wanted
             end_time:   end time of observational data wanted
+            resolution: granularity the data is needed in as ISO-8601 
+                        duration, ex P1D. Each element is fetched in the 
+                        coarsest time resolution the station has that is 
+                        not coarser than this, see plan_resolutions(). 
+                        Groups that fail are listed under 'failed' in the 
+                        response, and the error is returned only when no 
+                        group gave data
         """
-        elements = ','.join(element for element in elements)
+        if self.store and start_time and end_time and not repeat and not resolution:
+            stored = self.store.observations(source, elements, start_time, end_time)
+            if stored is not None:
+                return 200, stored
+
         time_string = self.convert_datetime(repeat = repeat,
                                             seperation = seperation,
                                             start_time = start_time,
                                             end_time = end_time)
-        return self.get_observations(sources = source,
-                                     reference_time = time_string,
-                                     elements = elements)
+        if not resolution:
+            return self.get_observations(sources = source,
+                                         reference_time = time_string,
+                                         elements = ','.join(elements))
+
+        # A failed group does not discard the others, it is listed under 'failed'
+        response_json, failed = {'data': [], 'failed': []}, None
+        plan = self.plan_resolutions(source, elements, resolution)
+        for time_resolution, planned in plan.items():
+            status_code, planned_json = self.get_observations(sources = source,
+                                                              reference_time = time_string,
+                                                              elements = ','.join(planned),
+                                                              time_resolutions = time_resolution)
+            if status_code == 200:
+                response_json['data'] += planned_json['data']
+            else:
+                failed = status_code, planned_json
+                response_json['failed'].append({'elements': planned,
+                                                'timeResolution': time_resolution,
+                                                'status': status_code})
+        if failed and not response_json['data']:
+            return failed
+        return 200, response_json
+
+    def plan_resolutions(self,
+                         source: str,
+                         elements: list,
+                         resolution: str) -> dict:
+        """
+        Description:
+            Picks for each element the coarsest time resolution available at 
+            the station that is not coarser than the wanted resolution, so 
+            the aggregation is done by the server. Returns the elements 
+            grouped by time resolution, with None for elements without a 
+            matching time series.
+        Args:
+            source:     station ID
+            elements:   list of which data type to access
+            resolution: granularity the data is needed in as ISO-8601 
+                        duration, ex P1D
+        """
+        wanted = duration_seconds(resolution)
+        station = self.stations.get(source.split(':')[0])
+        available = station.available if station else []
+
+        plan = {}
+        for element in elements:
+            candidates = [time_series['timeResolution'] for time_series in available
+                          if time_series['elementId'] == element and
+                          duration_seconds(time_series['timeResolution']) <= wanted]
+            best = max(candidates, key=duration_seconds, default=None)
+            plan.setdefault(best, []).append(element)
+        return plan
                                      
     def observation_air_temperature(self,
                                     source: str,
@@ -980,7 +2183,8 @@ class Stations(API):
                                     repeat: int = 0,
                                     seperation: str = None,
                                     start_time: 'datetime.datetime' = None,
-                                    end_time: 'datetime.datetime' = None) -> None:
+                                    end_time: 'datetime.datetime' = None,
+                                    resolution: str = None) -> (int, 'response json'):
         """
         Description:
             A simplified observations call for air temperature for  one station 
@@ -991,13 +2195,15 @@ class Stations(API):
                         duration between each interval
             start_time: starting time of observational data wanted
             end_time:   end time of observational data wanted
+            resolution: granularity the data is needed in, ex P1D
         """
         return self.observational_data(source = source,
                                        elements = ['air_temperature'],
                                        repeat = repeat,
                                        seperation = seperation,
                                        start_time = start_time,
-                                       end_time = end_time)
+                                       end_time = end_time,
+                                       resolution = resolution)
 
     def observation_precipitation_amount(self,
                                          source: str,
@@ -1005,7 +2211,8 @@ class Stations(API):
                                          repeat: int = 0,
                                          seperation: str = None,
                                          start_time: 'datetime.datetime' = None,
-                                         end_time: 'datetime.datetime' = None) -> None:
+                                         end_time: 'datetime.datetime' = None,
+                                         resolution: str = None) -> (int, 'response json'):
         """
         Description:
             A simplified observations call for percepitation amount for one 
@@ -1017,20 +2224,1601 @@ class Stations(API):
                         duration between each interval
             start_time: starting time of observational data wanted
             end_time:   end time of observational data wanted
+            resolution: granularity the data is needed in, ex P1D
         """
         return self.observational_data(source = source,
                                        elements = ['precipitation_amount'],
                                        repeat = repeat,
                                        seperation = seperation,
                                        start_time = start_time,
-                                       end_time = end_time)
+                                       end_time = end_time,
+                                       resolution = resolution)
 
 
-if __name__=='__main__':
-    api = 0
-    if api:
-        test = API()
-        test.test_gets()
+class ObservationStore:
+    """
+    Description:
+        Read-optimised file of fetched observations that many processes can 
+        memory-map and share. The file holds fixed-width columns of time 
+        (int64 s since epoch, UTC), value (float64) and quality code (int32), 
+        with the rows of each series stored together and sorted by time. A 
+        series is one source, element, time offset, level and time 
+        resolution, like the time series of Frost. A JSON header indexes the 
+        unit, row offset, row count and covered time range of each series, 
+        so a lookup is a dict access and two binary searches.
+
+        Layout: magic, header length (uint64), JSON header, then the time, 
+        value and quality columns, each aligned to 8 bytes.
+    """
+    magic = b'FROSTOBS'
+    # Index fields that tell series apart, with the observation_columns() name of each
+    key_fields = {'source': 'sourceId',
+                  'element': 'elementId',
+                  'timeOffset': 'timeOffset',
+                  'level': 'level',
+                  'timeResolution': 'timeResolution'}
+
+    def __init__(self,
+                 path: str) -> None:
+        """
+        Description:
+            Class instance initialization, maps the file read-only
+        Args:
+            path:   path of a file written with ObservationStore.write()
+        """
+        self.path = path
+        with open(path, 'rb') as store:
+            self.map = mmap.mmap(store.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[:8] != self.magic:
+            raise ValueError(f'{path} is not an observation store')
+        header_length, = struct.unpack_from('<Q', self.map, 8)
+        header = json.loads(self.map[16:16 + header_length])
+        self.index = {}
+        for series in header['series']:
+            self.index.setdefault((series['source'], series['element']), []).append(series)
+        rows = header['rows']
+        view = memoryview(self.map)
+        self.times = view[header['times']:header['times'] + 8*rows].cast('q')
+        self.values = view[header['values']:header['values'] + 8*rows].cast('d')
+        self.quality = view[header['quality']:header['quality'] + 4*rows].cast('i')
+
+    def __getstate__(self) -> dict:
+        """
+        Description:
+            Pickles the path only, the unpickled store maps the same file
+        """
+        return {'path': self.path}
+
+    def __setstate__(self,
+                     state: dict) -> None:
+        self.__init__(state['path'])
+
+    def close(self) -> None:
+        """
+        Description:
+            Releases the memory map
+        """
+        for column in (self.times, self.values, self.quality):
+            column.release()
+        self.map.close()
+
+    @staticmethod
+    def timestamp(time_: 'datetime.datetime') -> int:
+        """
+        Description:
+            Seconds since epoch, naive datetimes are taken to be UTC like in 
+            convert_datetime()
+        Args:
+            time_:  the datetime
+        """
+        return calendar.timegm(time_.utctimetuple())
+
+    def series(self,
+               source: str,
+               element: str) -> list:
+        """
+        Description:
+            Index entries of the series of a source and element, one per 
+            time offset, level and time resolution. A plain station ID also 
+            matches its main sensor, e.g. SN18700 matches SN18700:0
+        Args:
+            source:     source ID
+            element:    element ID
+        """
+        return self.index.get((source, element)) or self.index.get((f'{source}:0', element), [])
+
+    def covers(self,
+               source: str,
+               element: str,
+               start_time: 'datetime.datetime',
+               end_time: 'datetime.datetime') -> bool:
+        """
+        Description:
+            Whether the store holds all observations of the series of a 
+            source and element in a range
+        Args:
+            source:     source ID
+            element:    element ID
+            start_time: start of the range
+            end_time:   end of the range
+        """
+        start, end = self.timestamp(start_time), self.timestamp(end_time)
+        entries = self.series(source, element)
+        return bool(entries) and all(series['start'] <= start and end <= series['end']
+                                     for series in entries)
+
+    def lookup(self,
+               series: dict,
+               start_time: 'datetime.datetime',
+               end_time: 'datetime.datetime') -> tuple:
+        """
+        Description:
+            Rows of a series in [start_time, end_time) found by binary 
+            search. Returns (times, values, quality) as memoryviews into the 
+            mapped file, which have to be dropped before close().
+        Args:
+            series:     index entry from series()
+            start_time: start of the range
+            end_time:   end of the range
+        """
+        low, high = series['offset'], series['offset'] + series['count']
+        first = bisect.bisect_left(self.times, self.timestamp(start_time), low, high)
+        last = bisect.bisect_left(self.times, self.timestamp(end_time), first, high)
+        return self.times[first:last], self.values[first:last], self.quality[first:last]
+
+    def observations(self,
+                     source: str,
+                     elements: list,
+                     start_time: 'datetime.datetime',
+                     end_time: 'datetime.datetime') -> dict:
+        """
+        Description:
+            Stored observations in the format of get_observations(), or None 
+            if the store does not cover every element in the range
+        Args:
+            source:     source ID
+            elements:   element IDs
+            start_time: start of the range
+            end_time:   end of the range
+        """
+        if not all(self.covers(source, element, start_time, end_time) for element in elements):
+            return None
+        data = []
+        for element in elements:
+            for series in self.series(source, element):
+                # Fields of the series that every observation of it carries
+                fields = {'unit': series.get('unit'),
+                          'level': json.loads(series['level']) if series.get('level') else None,
+                          'timeOffset': series.get('timeOffset'),
+                          'timeResolution': series.get('timeResolution')}
+                fields = {name: field for name, field in fields.items() if field is not None}
+                for time_, value, quality_code in zip(*self.lookup(series, start_time, end_time)):
+                    observation = {'elementId': element, 'value': value, **fields}
+                    if quality_code >= 0:
+                        observation['qualityCode'] = quality_code
+                    reference_time = datetime.datetime.fromtimestamp(time_, datetime.timezone.utc)
+                    data.append({'sourceId': series['source'],
+                                 'referenceTime': f'{reference_time:%Y-%m-%dT%H:%M:%S}.000Z',
+                                 'observations': [observation]})
+        return {'data': data}
+
+    @classmethod
+    def write(cls,
+              path: str,
+              columns: dict,
+              start_time: 'datetime.datetime',
+              end_time: 'datetime.datetime') -> None:
+        """
+        Description:
+            Adds fetched observations to the store file, creating it if 
+            needed. The series in columns are recorded as complete for 
+            [start_time, end_time). The file is rewritten to a temporary 
+            file next to the old one and moved into place, so processes that 
+            have the old file mapped keep a consistent view. Writers hold a 
+            lock on path + '.lock' while they merge, so concurrent writes do 
+            not lose each other's series.
+        Args:
+            path:       path of the store file
+            columns:    columns from observation_columns() with everything 
+                        fetched for the range
+            start_time: start of the fetched range
+            end_time:   end of the fetched range
+        """
+        with open(path + '.lock', 'a') as lock:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            cls.merge(path, columns, start_time, end_time)
+
+    @classmethod
+    def merge(cls,
+              path: str,
+              columns: dict,
+              start_time: 'datetime.datetime',
+              end_time: 'datetime.datetime') -> None:
+        """
+        Description:
+            The read, merge and replace of write(), run under its lock
+        Args:
+            path:       path of the store file
+            columns:    columns from observation_columns()
+            start_time: start of the fetched range
+            end_time:   end of the fetched range
+        """
+        series = {}
+        if os.path.isfile(path):
+            old = cls(path)
+            for entries in old.index.values():
+                for entry in entries:
+                    rows = slice(entry['offset'], entry['offset'] + entry['count'])
+                    key = tuple(entry.get(field) for field in cls.key_fields)
+                    series[key] = {'unit': entry.get('unit'),
+                                   'start': entry['start'],
+                                   'end': entry['end'],
+                                   'rows': dict(zip(old.times[rows], zip(old.values[rows],
+                                                                         old.quality[rows])))}
+            old.close()
+
+        start, end = cls.timestamp(start_time), cls.timestamp(end_time)
+        new = {}
+        units = {}
+        keys = zip(*(columns.get(name, [None]*len(columns['value']))
+                     for name in cls.key_fields.values()))
+        for key, reference_time, value, quality, unit in zip(keys,
+                                                             columns['referenceTime'],
+                                                             columns['value'],
+                                                             columns['qualityCode'],
+                                                             columns['unit']):
+            time_ = datetime.datetime.fromisoformat(reference_time.replace('Z', '+00:00'))
+            new.setdefault(key, {})[cls.timestamp(time_)] = (value, quality)
+            units[key] = unit
+        for key, rows in new.items():
+            entry = series.setdefault(key, {'start': start, 'end': end, 'rows': {}})
+            if start <= entry['end'] and entry['start'] <= end:
+                entry['start'], entry['end'] = min(entry['start'], start), max(entry['end'], end)
+            elif end - start > entry['end'] - entry['start']:
+                # Coverage is one range per series, keep the longer one
+                entry['start'], entry['end'] = start, end
+            entry['unit'] = units[key]
+            entry['rows'].update(rows)
+
+        times, values, quality = array.array('q'), array.array('d'), array.array('i')
+        index = []
+        # Keys hold None for missing fields, which only sort as text
+        for key, entry in sorted(series.items(), key=lambda item: list(map(str, item[0]))):
+            index.append({**dict(zip(cls.key_fields, key)), 'unit': entry['unit'],
+                          'start': entry['start'], 'end': entry['end'],
+                          'offset': len(times), 'count': len(entry['rows'])})
+            for time_ in sorted(entry['rows']):
+                value, quality_code = entry['rows'][time_]
+                times.append(time_)
+                values.append(value)
+                quality.append(quality_code)
+
+        def align(offset):
+            return (offset + 7)//8*8
+
+        header = {'series': index, 'rows': len(times)}
+        # Room for the column offsets that are added below
+        header_length = len(json.dumps(header)) + 128
+        header['times'] = align(16 + header_length)
+        header['values'] = align(header['times'] + 8*len(times))
+        header['quality'] = align(header['values'] + 8*len(values))
+        encoded = json.dumps(header).encode().ljust(header_length)
+
+        descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(path) or '.',
+                                                 prefix=os.path.basename(path) + '.',
+                                                 suffix='.tmp')
+        try:
+            with os.fdopen(descriptor, 'wb') as store:
+                store.write(cls.magic + struct.pack('<Q', header_length) + encoded)
+                for offset, column in ((header['times'], times),
+                                       (header['values'], values),
+                                       (header['quality'], quality)):
+                    store.write(b'\0'*(offset - store.tell()))
+                    store.write(column.tobytes())
+            # mkstemp creates the file readable by its owner only
+            os.chmod(temporary, 0o644)
+            os.replace(temporary, path)
+        except BaseException:
+            os.remove(temporary)
+            raise
+
+
+class LatestPoller:
+    """
+    Description:
+        Incremental polling of the latest observations for many sources. 
+        Keeps the last seen referenceTime per source and element, batches 
+        many sources into each request and only asks for the interval after 
+        what has already been seen. Each series is polled again after its 
+        own timeResolution. New observations are published to subscribed 
+        callbacks, or can be consumed with the async iterator updates().
+    """
+    def __init__(self,
+                 api: API,
+                 sources: list,
+                 elements: list,
+                 *,
+                 batch_size: int = 50,
+                 min_interval: float = 60.0,
+                 default_interval: float = 600.0) -> None:
+        """
+        Description:
+            Class instance initialization
+        Args:
+            api:                API instance used for the requests
+            sources:            station IDs to poll, e.g. ['SN18700']
+            elements:           elements to poll for each station
+            batch_size:         number of sources in each request
+            min_interval:       shortest time between polls of a series in s
+            default_interval:   time between polls in s before the 
+                                timeResolution of a series is known
+        """
+        self.api = api
+        self.elements = list(elements)
+        self.batch_size = batch_size
+        self.min_interval = min_interval
+        self.default_interval = default_interval
+        self.last_seen = {}
+        self.intervals = {}
+        self.next_poll = {(source, element): 0.0
+                          for source in sources
+                          for element in self.elements}
+        self.subscribers = []
+
+    def subscribe(self,
+                  callback: typing.Callable[[list], None]) -> None:
+        """
+        Description:
+            Registers a callback that is called with the list of new 
+            observations after each poll that found any
+        Args:
+            callback:   function taking a list of observation rows
+        """
+        self.subscribers.append(callback)
+
+    def due(self) -> list:
+        """
+        Description:
+            The (source, element) series that should be polled now
+        """
+        now = time.monotonic()
+        return [series for series, next_poll in self.next_poll.items() if next_poll <= now]
+
+    def wait_time(self) -> float:
+        """
+        Description:
+            Seconds until the next series is due
+        """
+        if not self.next_poll:
+            return self.default_interval
+        return max(min(self.next_poll.values()) - time.monotonic(), 0.0)
+
+    def poll(self) -> list:
+        """
+        Description:
+            Polls all due series and returns the observations that are newer 
+            than the last seen referenceTime of their series. Series that 
+            have not been seen yet are asked for 'latest'. The others are 
+            grouped by their last seen time, so each request asks for the 
+            interval from that time until now and one stale series does not 
+            make the rest of a batch download old data again.
+        """
+        due = self.due()
+        now = datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+
+        groups = {}
+        for source, element in due:
+            since = self.last_seen.get((source, element))
+            reference_time = f'{since}/{now}' if since else 'latest'
+            sources, elements = groups.setdefault(reference_time, (set(), set()))
+            sources.add(source)
+            elements.add(element)
+
+        deltas = []
+        for reference_time, (sources, elements) in sorted(groups.items()):
+            sources = sorted(sources)
+            for i in range(0, len(sources), self.batch_size):
+                batch = sources[i:i + self.batch_size]
+                status_code, response_json = self.api.get_observations(
+                    sources = ','.join(batch),
+                    reference_time = reference_time,
+                    elements = ','.join(sorted(elements)))
+                if status_code == 200:
+                    deltas += self.update(response_json)
+
+        for series in due:
+            interval = self.intervals.get(series, self.default_interval)
+            self.next_poll[series] = time.monotonic() + interval
+
+        if deltas:
+            for callback in self.subscribers:
+                callback(deltas)
+        return deltas
+
+    def update(self,
+               response_json: dict) -> list:
+        """
+        Description:
+            Picks the new observations out of a response and moves the last 
+            seen referenceTime and poll interval of each series forward
+        Args:
+            response_json:  response from get_observations()
+        """
+        deltas = []
+        for item in response_json['data']:
+            source = item['sourceId'].split(':')[0]
+            for observation in item['observations']:
+                series = (source, observation['elementId'])
+                if series not in self.next_poll:
+                    continue
+                if item['referenceTime'] <= self.last_seen.get(series, ''):
+                    continue
+                deltas.append({'sourceId': item['sourceId'],
+                               'referenceTime': item['referenceTime'],
+                               **observation})
+                self.last_seen[series] = item['referenceTime']
+                if 'timeResolution' in observation:
+                    self.intervals[series] = max(duration_seconds(observation['timeResolution']),
+                                                 self.min_interval)
+        return deltas
+
+    def run(self,
+            *,
+            stop: threading.Event = None) -> None:
+        """
+        Description:
+            Polls until stop is set, sleeping until the next series is due
+        Args:
+            stop:   event that ends the polling loop
+        """
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            self.poll()
+            stop.wait(self.wait_time())
+
+    async def updates(self) -> typing.AsyncIterator[list]:
+        """
+        Description:
+            Async iterator over the lists of new observations. The requests 
+            run in the default executor so the event loop is not blocked.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            deltas = await loop.run_in_executor(None, self.poll)
+            if deltas:
+                yield deltas
+            await asyncio.sleep(self.wait_time())
+
+
+class RainfallIDF:
+    """
+    Description:
+        Batched rainfall IDF lookups for many points. Points near a station 
+        with IDF data use the station, the others are grouped by cell of the 
+        gridded IDF dataset so every station and cell is fetched only once. 
+        Curves are cached in memory and optionally in a JSON file, and 
+        intensities are interpolated bilinearly in log(duration) and 
+        log(frequency).
+    """
+    def __init__(self,
+                 api: API,
+                 dataset: str,
+                 *,
+                 cell_size: float = 0.01,
+                 unit: str = None,
+                 station_radius: float = None,
+                 cache_path: str = None) -> None:
+        """
+        Description:
+            Class instance initialization
+        Args:
+            api:            API instance used for the requests
+            dataset:        name of the gridded IDF dataset source
+            cell_size:      size of the grid cells to group points by in 
+                            degrees
+            unit:           intensity unit, 'mm' or 'l/sHa', see 
+                            API.get_frequencies_rainfall()
+            station_radius: use station IDF data for points within this 
+                            distance in km of a station, None to only use 
+                            the gridded dataset
+            cache_path:     JSON file to keep fetched curves in between runs
+        """
+        import_numpy()
+        self.api = api
+        self.dataset = dataset
+        self.cell_size = cell_size
+        self.unit = unit
+        self.station_radius = station_radius
+        self.cache_path = cache_path
+        self.station_coords = None
+        self.curves = {}
+        if cache_path and os.path.isfile(cache_path):
+            with open(cache_path) as cache:
+                self.curves = json.load(cache)
+
+    def stations(self) -> dict:
+        """
+        Description:
+            Station sources with rainfall IDF data and their (longitude, 
+            latitude), from get_frequencies_rainfall_available_sources()
+        """
+        if self.station_coords is None:
+            self.station_coords = {}
+            status_code, response_json = self.api.get_frequencies_rainfall_available_sources(
+                types = 'SensorSystem',
+                fields = 'sourceId')
+            ids = [] if status_code != 200 else [data['sourceId'].split(':')[0]
+                                                 for data in response_json['data']]
+            for i in range(0, len(ids), 100):
+                status_code, response_json = self.api.get_sources(ids = ','.join(ids[i:i + 100]),
+                                                                  fields = 'id,geometry')
+                if status_code == 200:
+                    for data in response_json['data']:
+                        if 'geometry' in data:
+                            self.station_coords[data['id']] = data['geometry']['coordinates'][:2]
+        return self.station_coords
+
+    def keys(self,
+             longitude: 'np.ndarray',
+             latitude: 'np.ndarray') -> 'np.ndarray':
+        """
+        Description:
+            The curve key for each point, a station ID or 'cell:<i>:<j>' for 
+            a grid cell
+        Args:
+            longitude:  longitudes of the points in WGS84
+            latitude:   latitudes of the points in WGS84
+        """
+        longitude = np.asarray(longitude, dtype=float)
+        latitude = np.asarray(latitude, dtype=float)
+        i = np.floor(longitude/self.cell_size).astype(int)
+        j = np.floor(latitude/self.cell_size).astype(int)
+        keys = np.array([f'cell:{a}:{b}' for a, b in zip(i.ravel(), j.ravel())], dtype=object)
+
+        if self.station_radius and self.stations():
+            ids = list(self.station_coords)
+            coords = np.radians(np.array([self.station_coords[id_] for id_ in ids]))
+            lon = np.radians(longitude.ravel())[:, None]
+            lat = np.radians(latitude.ravel())[:, None]
+            x = (coords[None, :, 0] - lon)*np.cos((coords[None, :, 1] + lat)/2)
+            y = coords[None, :, 1] - lat
+            distance = 6371.0*np.sqrt(x*x + y*y) # km
+            nearest = np.argmin(distance, axis=1)
+            near = distance[np.arange(len(nearest)), nearest] <= self.station_radius
+            keys[near] = np.array(ids, dtype=object)[nearest[near]]
+        return keys.reshape(longitude.shape)
+
+    def fetch(self,
+              keys: list) -> None:
+        """
+        Description:
+            Fetches the curves that are not cached yet, each unique key once. 
+            Only curves and 404 answers (no data) are cached.
+        Args:
+            keys:   curve keys from keys()
+        """
+        missing = sorted(set(keys) - set(self.curves))
+        for key in missing:
+            if key.startswith('cell:'):
+                i, j = (int(index) for index in key.split(':')[1:])
+                location = f'POINT({(i + 0.5)*self.cell_size} {(j + 0.5)*self.cell_size})'
+                status_code, response_json = self.api.get_frequencies_rainfall(
+                    sources = self.dataset,
+                    location = location,
+                    unit = self.unit)
+            else:
+                status_code, response_json = self.api.get_frequencies_rainfall(sources = key,
+                                                                               unit = self.unit)
+            if status_code == 200:
+                self.curves[key] = [[value['duration'], value['frequency'], value['intensity']]
+                                    for data in response_json['data']
+                                    for value in data['values']]
+            elif status_code == 404:
+                # No IDF data here, which is worth remembering
+                self.curves[key] = []
+            # Other failures such as 429 or 5xx are not cached and retried next time
+
+        if missing and self.cache_path:
+            with open(self.cache_path, 'w') as cache:
+                json.dump(self.curves, cache)
+
+    def intensity(self,
+                  longitude: 'np.ndarray',
+                  latitude: 'np.ndarray',
+                  duration: 'np.ndarray',
+                  frequency: 'np.ndarray') -> 'np.ndarray':
+        """
+        Description:
+            Rainfall intensity for arbitrary points, durations and 
+            frequencies. The inputs are broadcast against each other. Points 
+            without IDF data give NaN.
+        Args:
+            longitude:  longitudes of the points in WGS84
+            latitude:   latitudes of the points in WGS84
+            duration:   durations in minutes
+            frequency:  frequencies (return periods) in years
+        """
+        longitude, latitude, duration, frequency = np.broadcast_arrays(longitude, latitude,
+                                                                       duration, frequency)
+        keys = self.keys(longitude, latitude).ravel()
+        log_duration = np.log(np.asarray(duration, dtype=float)).ravel()
+        log_frequency = np.log(np.asarray(frequency, dtype=float)).ravel()
+        unique_keys, inverse = np.unique(keys.astype(str), return_inverse=True)
+        self.fetch(list(unique_keys))
+
+        result = np.full(len(keys), np.nan)
+        for k, key in enumerate(unique_keys):
+            if not self.curves.get(key):
+                continue
+            index = np.nonzero(inverse == k)[0]
+            table = np.array(self.curves[key], dtype=float)
+            durations = np.unique(table[:, 0])
+            frequencies = np.unique(table[:, 1])
+            grid = np.full((len(durations), len(frequencies)), np.nan)
+            grid[np.searchsorted(durations, table[:, 0]),
+                 np.searchsorted(frequencies, table[:, 1])] = table[:, 2]
+
+            d0, d1, wd = bracket(np.log(durations), log_duration[index])
+            f0, f1, wf = bracket(np.log(frequencies), log_frequency[index])
+            result[index] = ((1 - wd)*(1 - wf)*grid[d0, f0] + wd*(1 - wf)*grid[d1, f0] +
+                             (1 - wd)*wf*grid[d0, f1] + wd*wf*grid[d1, f1])
+        return result.reshape(longitude.shape)
+
+
+class ClimateNormals:
+    """
+    Description:
+        Bulk loader for climate normals. Plans the fewest get_climate_normals 
+        requests that cover the wanted sources, elements and periods from 
+        get_climate_normals_available, and stores the normals in dense arrays 
+        indexed by (source, element, period, month) and (source, element, 
+        period, day of year), so normals for many observations are looked up 
+        with vectorised indexing. Requests that fail are listed in failed, 
+        and their normals are NaN.
+    """
+    # Day of year of the first day of each month, in a leap year
+    month_offsets = [0, 31, 60, 91, 121, 152, 182, 213, 244, 274, 305, 335]
+
+    def __init__(self,
+                 api: API,
+                 *,
+                 sources: list = None,
+                 elements: list = None,
+                 periods: list = None,
+                 chunk_size: int = 100) -> None:
+        """
+        Description:
+            Class instance initialization, loads the normals
+        Args:
+            api:        API instance used for the requests
+            sources:    station IDs to load normals for, None for all
+            elements:   elements to load normals for, None for all
+            periods:    validity periods to load, e.g. ['1961/1990'], None 
+                        for all
+            chunk_size: maximum number of sources in each request
+        """
+        import_numpy()
+        self.api = api
+        self.chunk_size = chunk_size
+        self.sources = []
+        self.elements = []
+        self.periods = []
+        self.monthly = None
+        self.daily = None
+        self.failed = []
+        self.load(sources = sources, elements = elements, periods = periods)
+
+    def plan(self,
+             *,
+             sources: list = None,
+             elements: list = None,
+             periods: list = None) -> list:
+        """
+        Description:
+            Groups the available (source, element, period) combinations into 
+            requests. Sources with the same elements for a period share 
+            requests, chunked to at most chunk_size sources. Returns a list 
+            of (sources, elements, period).
+        Args:
+            sources:    station IDs, None for all
+            elements:   elements, None for all
+            periods:    validity periods, None for all
+        """
+        status_code, response_json = self.api.get_climate_normals_available(
+            sources = ','.join(sources) if sources else None,
+            elements = ','.join(elements) if elements else None,
+            periods = ','.join(periods) if periods else None)
+        if status_code != 200:
+            if status_code != 404:
+                self.failed.append({'sources': sources, 'elements': elements,
+                                    'period': periods, 'status': status_code})
+            return []
+
+        available = {}
+        for data in response_json['data']:
+            key = (data['period'], data['sourceId'])
+            available.setdefault(key, set()).add(data['elementId'])
+
+        groups = {}
+        for (period, source), source_elements in available.items():
+            groups.setdefault((period, tuple(sorted(source_elements))), []).append(source)
+
+        batches = []
+        for (period, group_elements), group_sources in sorted(groups.items()):
+            group_sources.sort()
+            for i in range(0, len(group_sources), self.chunk_size):
+                batches.append((group_sources[i:i + self.chunk_size], list(group_elements),
+                                period))
+        return batches
+
+    def load(self,
+             *,
+             sources: list = None,
+             elements: list = None,
+             periods: list = None) -> None:
+        """
+        Description:
+            Fetches the normals planned by plan() and fills the arrays. 
+            Failed requests are listed in failed as dicts of sources, 
+            elements, period and status, with a warning.
+        Args:
+            sources:    station IDs, None for all
+            elements:   elements, None for all
+            periods:    validity periods, None for all
+        """
+        rows = []
+        self.failed = []
+        for request_sources, request_elements, period in self.plan(sources = sources,
+                                                                   elements = elements,
+                                                                   periods = periods):
+            status_code, response_json = self.api.get_climate_normals(
+                sources = ','.join(request_sources),
+                elements = ','.join(request_elements),
+                period = period)
+            if status_code == 200:
+                rows += response_json['data']
+            elif status_code != 404:
+                self.failed.append({'sources': request_sources, 'elements': request_elements,
+                                    'period': period, 'status': status_code})
+        if self.failed:
+            warnings.warn(f'{len(self.failed)} climate normals requests failed, their normals ' +\
+                          'are NaN, see ClimateNormals.failed')
+
+        self.sources = sorted({row['sourceId'] for row in rows})
+        self.elements = sorted({row['elementId'] for row in rows})
+        self.periods = sorted({row['period'] for row in rows})
+        self.source_index = {source: i for i, source in enumerate(self.sources)}
+        self.element_index = {element: i for i, element in enumerate(self.elements)}
+        self.period_index = {period: i for i, period in enumerate(self.periods)}
+
+        shape = (len(self.sources), len(self.elements), len(self.periods))
+        self.monthly = np.full(shape + (12,), np.nan)
+        if any('day' in row for row in rows):
+            self.daily = np.full(shape + (366,), np.nan)
+        for row in rows:
+            index = (self.source_index[row['sourceId']],
+                     self.element_index[row['elementId']],
+                     self.period_index[row['period']])
+            if 'day' in row:
+                day = self.month_offsets[row['month'] - 1] + row['day'] - 1
+                self.daily[index + (day,)] = row['normal']
+            else:
+                self.monthly[index + (row['month'] - 1,)] = row['normal']
+
+    def indices(self,
+                ids: 'np.ndarray',
+                index: dict) -> 'np.ndarray':
+        """
+        Description:
+            Maps IDs to array indices, -1 for unknown IDs. Source IDs with a 
+            sensor suffix such as SN18700:0 are matched on the station.
+        Args:
+            ids:    IDs to map
+            index:  from ID to array index
+        """
+        unique_ids, inverse = np.unique(np.asarray(ids, dtype=str), return_inverse=True)
+        unique_indices = np.array([index.get(id_.split(':')[0], index.get(id_, -1))
+                                   for id_ in unique_ids], dtype=int)
+        return unique_indices[inverse]
+
+    def lookup(self,
+               sources: 'np.ndarray',
+               elements: 'np.ndarray',
+               period: str,
+               times: 'np.ndarray',
+               *,
+               daily: bool = False) -> 'np.ndarray':
+        """
+        Description:
+            Normals for many observations at once. The inputs are broadcast 
+            against each other, and observations without a normal give NaN.
+        Args:
+            sources:    source ID of each observation
+            elements:   element of each observation
+            period:     validity period of the normals, e.g. '1961/1990'
+            times:      time of each observation as numpy datetime64
+            daily:      use daily instead of monthly normals
+        """
+        sources, elements, times = np.broadcast_arrays(np.asarray(sources, dtype=str),
+                                                       np.asarray(elements, dtype=str),
+                                                       np.asarray(times, dtype='datetime64[s]'))
+        table = self.daily if daily else self.monthly
+        result = np.full(times.shape, np.nan)
+        if table is None or period not in self.period_index:
+            return result
+
+        source = self.indices(sources.ravel(), self.source_index).reshape(times.shape)
+        element = self.indices(elements.ravel(), self.element_index).reshape(times.shape)
+        months = times.astype('datetime64[M]')
+        month = months.astype(int) % 12
+        if daily:
+            day = (times.astype('datetime64[D]') - months.astype('datetime64[D]')).astype(int)
+            position = np.array(self.month_offsets)[month] + day
+        else:
+            position = month
+
+        known = (source >= 0) & (element >= 0)
+        result[known] = table[source[known], element[known],
+                              self.period_index[period], position[known]]
+        return result
+
+    def anomaly(self,
+                sources: 'np.ndarray',
+                elements: 'np.ndarray',
+                period: str,
+                times: 'np.ndarray',
+                values: 'np.ndarray',
+                *,
+                daily: bool = False) -> 'np.ndarray':
+        """
+        Description:
+            Deviation of observed values from the normals, see lookup()
+        Args:
+            sources:    source ID of each observation
+            elements:   element of each observation
+            period:     validity period of the normals, e.g. '1961/1990'
+            times:      time of each observation as numpy datetime64
+            values:     observed values
+            daily:      use daily instead of monthly normals
+        """
+        return np.asarray(values, dtype=float) - self.lookup(sources, elements, period, times,
+                                                             daily = daily)
+
+
+# dtype of the structured observation arrays from observation_array()
+OBSERVATION_DTYPE = [('source', object),
+                     ('element', object),
+                     ('time', 'datetime64[s]'),
+                     ('value', float),
+                     ('quality', int)]
+
+
+def observation_array(observations: dict) -> 'np.ndarray':
+    """
+    Description:
+        Structured array with one row per observed value, see 
+        OBSERVATION_DTYPE
+    Args:
+        observations:   decoded response from get_observations() or 
+                        Stations.observational_data(), or columns from 
+                        observation_columns()
+    """
+    import_numpy()
+    columns = observations if 'referenceTime' in observations else \
+        observation_columns(observations)
+    result = np.empty(len(columns['value']), dtype=OBSERVATION_DTYPE)
+    result['source'] = columns['sourceId']
+    result['element'] = columns['elementId']
+    result['time'] = [time.rstrip('Z') for time in columns['referenceTime']]
+    result['value'] = columns['value']
+    result['quality'] = columns['qualityCode']
+    return result
+
+
+def local_time(times: 'np.ndarray',
+               timezone: str) -> 'np.ndarray':
+    """
+    Description:
+        Converts UTC datetime64 values to local wall clock time. The UTC 
+        offset is only looked up once per distinct hour.
+    Args:
+        times:      UTC times as datetime64
+        timezone:   IANA time zone name, e.g. 'Europe/Oslo'
+    """
+    import_numpy()
+    if timezone == 'UTC':
+        return times
+    zone = zoneinfo.ZoneInfo(timezone)
+    hours, inverse = np.unique(times.astype('datetime64[h]'), return_inverse=True)
+    offsets = [datetime.datetime.fromtimestamp(int(hour), zone).utcoffset()
+               for hour in hours.astype('datetime64[s]').astype(int)]
+    offsets = np.array([int(offset.total_seconds()) for offset in offsets],
+                       dtype='timedelta64[s]')
+    return times + offsets[inverse]
+
+
+def series_groups(observations: 'np.ndarray',
+                  *keys: 'np.ndarray') -> tuple:
+    """
+    Description:
+        Numbers the groups of rows with equal source, element and extra keys. 
+        Returns the group number of each row and the index of the first row 
+        of each group.
+    Args:
+        observations:   structured array from observation_array()
+        keys:           extra integer keys to group on
+    """
+    import_numpy()
+    codes = [np.unique(observations[name].astype(str), return_inverse=True)[1]
+             for name in ('source', 'element')]
+    codes += [np.unique(key, return_inverse=True)[1] for key in keys]
+    combined = np.ravel_multi_index(codes, [code.max() + 1 if len(code) else 1 for code in codes])
+    unique, first, groups = np.unique(combined, return_index=True, return_inverse=True)
+    return groups.ravel(), first
+
+
+def check_aggregation(how: str,
+                      percentile: float = None,
+                      *,
+                      supported: tuple = ('sum', 'mean', 'min', 'max', 'percentile')) -> None:
+    """
+    Description:
+        Raises ValueError for an unknown aggregation or a missing or out of 
+        range percentile, before any work is done
+    Args:
+        how:        'sum', 'mean', 'min', 'max' or 'percentile'
+        percentile: percentile between 0 and 100 when how is 'percentile'
+        supported:  aggregations the caller implements
+    """
+    if how not in supported:
+        raise ValueError(f'Unknown aggregation {how}, use one of {", ".join(supported)}')
+    if how == 'percentile' and (percentile is None or not 0 <= percentile <= 100):
+        raise ValueError('percentile must be between 0 and 100 for how=\'percentile\', ' +\
+                         f'got {percentile}')
+
+
+def aggregate(values: 'np.ndarray',
+              groups: 'np.ndarray',
+              how: str,
+              *,
+              percentile: float = None) -> tuple:
+    """
+    Description:
+        Reduces values by group number, ignoring NaN. Returns the aggregated 
+        value and number of valid values of each group.
+    Args:
+        values:     values to aggregate
+        groups:     group number of each value, numbered from 0
+        how:        'sum', 'mean', 'min', 'max' or 'percentile'
+        percentile: percentile between 0 and 100 when how is 'percentile'
+    """
+    import_numpy()
+    check_aggregation(how, percentile)
+    size = groups.max() + 1 if len(groups) else 0
+    valid = ~np.isnan(values)
+    count = np.bincount(groups[valid], minlength=size)
+    total = np.bincount(groups[valid], weights=values[valid], minlength=size)
+
+    if how == 'sum':
+        result = total
+    elif how == 'mean':
+        with np.errstate(invalid='ignore', divide='ignore'):
+            result = total/count
+    else:
+        # Sorted by group and value, NaN last within each group
+        order = np.lexsort((values, groups))
+        starts = np.searchsorted(groups[order], np.arange(size))
+        if how == 'min':
+            position = np.zeros(size)
+        elif how == 'max':
+            position = np.maximum(count - 1, 0).astype(float)
+        else:
+            position = np.maximum(count - 1, 0)*percentile/100
+        lower = np.floor(position).astype(int)
+        upper = np.ceil(position).astype(int)
+        weight = position - lower
+        ordered = values[order]
+        result = (1 - weight)*ordered[starts + lower] + weight*ordered[starts + upper]
+
+    return np.where(count > 0, result, np.nan), count
+
+
+def resample(observations: 'np.ndarray',
+             frequency: str,
+             how: str = 'mean',
+             *,
+             percentile: float = None,
+             timezone: str = 'UTC',
+             min_count: int = 1) -> 'np.ndarray':
+    """
+    Description:
+        Aggregates observations into calendar periods, per source and 
+        element, in a single pass. Periods are taken in local time of the 
+        given time zone, so days and months start at local midnight. 
+        Returns a structured array with source, element, time (local start 
+        of the period), value and count (number of valid values).
+    Args:
+        observations:   structured array from observation_array()
+        frequency:      'h', 'D', 'M' or 'Y' for hourly, daily, monthly or 
+                        yearly periods
+        how:            'sum', 'mean', 'min', 'max' or 'percentile'
+        percentile:     percentile between 0 and 100 when how is 
+                        'percentile'
+        timezone:       IANA time zone name used for the periods
+        min_count:      periods with fewer valid values give NaN
+    """
+    import_numpy()
+    check_aggregation(how, percentile)
+    periods = local_time(observations['time'], timezone).astype(f'datetime64[{frequency}]')
+    groups, first = series_groups(observations, periods.astype(int))
+    values, count = aggregate(observations['value'], groups, how, percentile = percentile)
+
+    result = np.empty(len(first), dtype=[('source', object),
+                                         ('element', object),
+                                         ('time', 'datetime64[s]'),
+                                         ('value', float),
+                                         ('count', int)])
+    result['source'] = observations['source'][first]
+    result['element'] = observations['element'][first]
+    result['time'] = periods[first]
+    result['value'] = np.where(count >= min_count, values, np.nan)
+    result['count'] = count
+    return result
+
+
+def rolling(observations: 'np.ndarray',
+            window: str,
+            how: str = 'mean',
+            *,
+            min_count: int = 1) -> 'np.ndarray':
+    """
+    Description:
+        Aggregates each observation with the observations of the same 
+        source and element in the preceding time window, including itself. 
+        Returns a structured array like observation_array(), sorted by 
+        source, element and time, with the aggregated value and a count 
+        of valid values.
+    Args:
+        observations:   structured array from observation_array()
+        window:         window length as ISO-8601 duration, e.g. 'P1D'
+        how:            'sum', 'mean', 'min' or 'max'. Percentiles are not 
+                        supported, since a window is not one group; use 
+                        resample() for percentiles of calendar periods
+        min_count:      windows with fewer valid values give NaN
+    """
+    import_numpy()
+    check_aggregation(how, supported = ('sum', 'mean', 'min', 'max'))
+    output = np.empty(len(observations), dtype=[('source', object),
+                                                ('element', object),
+                                                ('time', 'datetime64[s]'),
+                                                ('value', float),
+                                                ('count', int)])
+    if not len(observations):
+        return output
+
+    groups, first = series_groups(observations)
+    seconds = observations['time'].astype(int)
+    seconds -= seconds.min()
+    order = np.lexsort((seconds, groups))
+    observations = observations[order]
+    groups = groups[order]
+    values = observations['value']
+    width = int(duration_seconds(window))
+
+    # Shift every series past the previous one so one sorted key covers all
+    key = seconds[order] + groups*(seconds.max() + width + 1)
+    start = np.searchsorted(key, key - width, side='right')
+    end = np.arange(1, len(key) + 1)
+
+    valid = ~np.isnan(values)
+    count = np.concatenate(([0], np.cumsum(valid)))
+    total = np.concatenate(([0.0], np.cumsum(np.where(valid, values, 0.0))))
+    count = count[end] - count[start]
+    if how in ('sum', 'mean'):
+        result = total[end] - total[start]
+        if how == 'mean':
+            with np.errstate(invalid='ignore', divide='ignore'):
+                result = result/count
+    else:
+        reduce = np.fmin if how == 'min' else np.fmax
+        bounds = np.column_stack((start, end)).ravel()
+        result = reduce.reduceat(np.append(values, np.nan), bounds)[::2]
+
+    result = np.where(count >= min_count, result, np.nan)
+    output['source'] = observations['source']
+    output['element'] = observations['element']
+    output['time'] = observations['time']
+    output['value'] = result
+    output['count'] = count
+    return output
+
+
+def element_metadata(api: API,
+                     elements: list) -> dict:
+    """
+    Description:
+        Name and CF metadata of elements from get_elements(), by element ID
+    Args:
+        api:        API instance used for the request
+        elements:   element IDs
+    """
+    status_code, response_json = api.get_elements(ids = ','.join(elements),
+                                                  fields = 'id,name,cfStandardName,cfUnit')
+    if status_code != 200:
+        return {}
+    return {data['id']: data for data in response_json['data']}
+
+
+def source_coordinates(api: API,
+                       sources: list) -> dict:
+    """
+    Description:
+        Longitude and latitude of sources from get_sources(), by station ID 
+        without sensor suffix
+    Args:
+        api:        API instance used for the request
+        sources:    source IDs, e.g. SN18700 or SN18700:0
+    """
+    ids = ','.join(dict.fromkeys(source.split(':')[0] for source in sources))
+    status_code, response_json = api.get_sources(ids = ids, fields = 'id,geometry')
+    if status_code != 200:
+        return {}
+    return {data['id']: data['geometry']['coordinates'][:2]
+            for data in response_json['data'] if 'geometry' in data}
+
+
+def export_observations(api: API,
+                        queries: list,
+                        writer: 'ObservationWriter') -> int:
+    """
+    Description:
+        Streams observations into a writer one response at a time, so peak 
+        memory is bounded by the size of one request and not the whole 
+        export. Returns the number of rows written.
+    Args:
+        api:        API instance used for the requests
+        queries:    list of dicts with the keyword arguments of 
+                    get_observations(), each one is a batch
+        writer:     ObservationWriter to write the batches to
+    """
+    rows = 0
+    for query in queries:
+        status_code, response_json = api.get_observations(**query)
+        if status_code == 200:
+            columns = observation_columns(response_json)
+            del response_json
+            writer.write(columns)
+            rows += len(columns['value'])
+    return rows
+
+
+class ObservationWriter(abc.ABC):
+    """
+    Description:
+        Base class of the export writers. Batches are columns from 
+        observation_columns(), and writers are used as context managers.
+    """
+    @abc.abstractmethod
+    def write(self,
+              columns: dict) -> None:
+        """
+        Description:
+            Writes one batch
+        Args:
+            columns:    columns from observation_columns()
+        """
+
+    @abc.abstractmethod
+    def close(self) -> None:
+        """
+        Description:
+            Finishes the file
+        """
+
+    def __enter__(self) -> 'ObservationWriter':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+def arrow_schema() -> 'pa.Schema':
+    """
+    Description:
+        Arrow schema of the exported observations
+    """
+    pa = import_optional('pyarrow', 'arrow')
+    return pa.schema([('sourceId', pa.string()),
+                      ('referenceTime', pa.timestamp('ms', tz='UTC')),
+                      ('elementId', pa.string()),
+                      ('value', pa.float64()),
+                      ('unit', pa.string()),
+                      ('qualityCode', pa.int32()),
+                      ('timeOffset', pa.string()),
+                      ('timeResolution', pa.string()),
+                      ('level', pa.string())])
+
+
+def arrow_batch(columns: dict) -> 'pa.RecordBatch':
+    """
+    Description:
+        Arrow record batch from observation_columns(). The numeric columns 
+        are wrapped without copying.
+    Args:
+        columns:    columns from observation_columns()
+    """
+    pa = import_optional('pyarrow', 'arrow')
+    schema = arrow_schema()
+    length = len(columns['value'])
+    times = [datetime.datetime.fromisoformat(reference_time.replace('Z', '+00:00'))
+             for reference_time in columns['referenceTime']]
+    arrays = []
+    for field in schema:
+        if field.name == 'referenceTime':
+            arrays.append(pa.array(times, type=field.type))
+        elif field.name in ('value', 'qualityCode'):
+            arrays.append(pa.Array.from_buffers(field.type, length,
+                                                [None, pa.py_buffer(columns[field.name])]))
+        else:
+            arrays.append(pa.array(columns[field.name], type=field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+class ArrowWriter(ObservationWriter):
+    """
+    Description:
+        Writes observations to an Arrow IPC file, one record batch per batch
+    """
+    def __init__(self,
+                 path: str) -> None:
+        """
+        Description:
+            Class instance initialization
+        Args:
+            path:   path of the Arrow IPC file
+        """
+        pa = import_optional('pyarrow', 'arrow')
+        self.writer = pa.ipc.new_file(path, arrow_schema())
+
+    def write(self,
+              columns: dict) -> None:
+        self.writer.write_batch(arrow_batch(columns))
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+class ParquetWriter(ObservationWriter):
+    """
+    Description:
+        Writes observations to a Parquet file, one row group per batch
+    """
+    def __init__(self,
+                 path: str) -> None:
+        """
+        Description:
+            Class instance initialization
+        Args:
+            path:   path of the Parquet file
+        """
+        pq = import_optional('pyarrow.parquet', 'arrow')
+        self.writer = pq.ParquetWriter(path, arrow_schema())
+
+    def write(self,
+              columns: dict) -> None:
+        self.writer.write_batch(arrow_batch(columns))
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+class NetCDFWriter(ObservationWriter):
+    """
+    Description:
+        Writes observations to a CF-compliant NetCDF file with point 
+        featureType. Each (source, referenceTime) is one point along the 
+        unlimited obs dimension with the station position in lat and lon, 
+        and each element is a variable with its cfStandardName and cfUnit 
+        from get_elements(). An element seen more than once at the same 
+        source and time, e.g. at other levels or time offsets, goes to an 
+        extra point of that source and time instead of overwriting a value.
+    """
+    def __init__(self,
+                 path: str,
+                 elements: list,
+                 metadata: dict,
+                 coordinates: dict) -> None:
+        """
+        Description:
+            Class instance initialization
+        Args:
+            path:           path of the NetCDF file
+            elements:       element IDs that get a variable each
+            metadata:       element metadata from element_metadata()
+            coordinates:    station positions from source_coordinates(), 
+                            stations without one get NaN
+        """
+        import_numpy('netcdf')
+        netCDF4 = import_optional('netCDF4', 'netcdf')
+        self.coordinates = coordinates
+        self.dataset = netCDF4.Dataset(path, 'w', format='NETCDF4')
+        self.dataset.Conventions = 'CF-1.8'
+        self.dataset.featureType = 'point'
+        self.dataset.source = 'Frost API, MET Norway'
+        self.dataset.createDimension('obs', None)
+
+        time = self.dataset.createVariable('time', 'f8', ('obs',))
+        time.standard_name = 'time'
+        time.units = 'seconds since 1970-01-01 00:00:00 UTC'
+        time.calendar = 'standard'
+        latitude = self.dataset.createVariable('lat', 'f8', ('obs',), fill_value=np.nan)
+        latitude.standard_name = 'latitude'
+        latitude.units = 'degrees_north'
+        longitude = self.dataset.createVariable('lon', 'f8', ('obs',), fill_value=np.nan)
+        longitude.standard_name = 'longitude'
+        longitude.units = 'degrees_east'
+        station = self.dataset.createVariable('station_id', str, ('obs',))
+        station.long_name = 'Frost API source ID'
+
+        self.variables = {}
+        for element in elements:
+            name = re.sub(r'\W+', '_', element).strip('_')
+            variable = self.dataset.createVariable(name, 'f8', ('obs',), fill_value=np.nan)
+            variable.long_name = metadata.get(element, {}).get('name', element)
+            variable.frost_element_id = element
+            variable.coordinates = 'time lat lon station_id'
+            if metadata.get(element, {}).get('cfStandardName'):
+                variable.standard_name = metadata[element]['cfStandardName']
+            if metadata.get(element, {}).get('cfUnit'):
+                variable.units = metadata[element]['cfUnit']
+            self.variables[element] = variable
+        self.size = 0
+
+    def write(self,
+              columns: dict) -> None:
+        # The n-th value of an element at a source and time goes to the n-th point there
+        points = {}
+        seen = {}
+        index = []
+        for key in zip(columns['sourceId'], columns['referenceTime'], columns['elementId']):
+            occurrence = seen[key] = seen.get(key, -1) + 1
+            index.append(points.setdefault((key[0], key[1], occurrence), len(points)))
+        if not points:
+            return
+        index = np.array(index)
+        values = np.frombuffer(columns['value'], dtype=float)
+        elements = np.array(columns['elementId'], dtype=object)
+        end = self.size + len(points)
+
+        sources, times, _ = zip(*points)
+        self.dataset['time'][self.size:end] = [
+            datetime.datetime.fromisoformat(reference_time.replace('Z', '+00:00')).timestamp()
+            for reference_time in times]
+        positions = np.array([self.coordinates.get(source.split(':')[0], (np.nan, np.nan))
+                              for source in sources], dtype=float)
+        self.dataset['lon'][self.size:end] = positions[:, 0]
+        self.dataset['lat'][self.size:end] = positions[:, 1]
+        self.dataset['station_id'][self.size:end] = np.array(sources, dtype=object)
+        for element, variable in self.variables.items():
+            rows = elements == element
+            data = np.full(len(points), np.nan)
+            data[index[rows]] = values[rows]
+            variable[self.size:end] = data
+        self.size = end
+
+    def close(self) -> None:
+        self.dataset.close()
+
+
+class CSVWriter(ObservationWriter):
+    """
+    Description:
+        Writes observations to a CSV file with one row per observed value
+    """
+    def __init__(self,
+                 path: str) -> None:
+        """
+        Description:
+            Class instance initialization
+        Args:
+            path:   path of the CSV file
+        """
+        self.file = open(path, 'w', newline='')
+        self.writer = None
+
+    def write(self,
+              columns: dict) -> None:
+        if self.writer is None:
+            self.writer = csv.writer(self.file)
+            self.writer.writerow(columns)
+        self.writer.writerows(zip(*columns.values()))
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def time_chunks(start_time: 'datetime.datetime',
+                end_time: 'datetime.datetime',
+                step: 'datetime.timedelta') -> list:
+    """
+    Description:
+        Splits a time range into reference_time intervals of at most step
+    Args:
+        start_time: start of the range
+        end_time:   end of the range
+        step:       length of each interval
+    """
+    chunks = []
+    while start_time < end_time:
+        chunk_end = min(start_time + step, end_time)
+        chunks.append(start_time.strftime('%Y-%m-%dT%H:%M:%S.000Z') + '/' +\
+                      chunk_end.strftime('%Y-%m-%dT%H:%M:%S.000Z'))
+        start_time = chunk_end
+    return chunks
+
+
+def fetch_concurrently(api: API,
+                       queries: list,
+                       workers: int) -> typing.Iterator[tuple]:
+    """
+    Description:
+        Runs get_observations() queries in a thread pool and yields (status 
+        code, response json, latency in s) in query order. Queries that 
+        raise a requests exception, e.g. a timeout, give None as status 
+        code and response json, so one failure does not stop the others. At most twice 
+        the number of workers are in flight, so finished responses do not 
+        pile up in memory while the consumer writes them.
+    Args:
+        api:        API instance used for the requests
+        queries:    list of dicts with the keyword arguments of 
+                    get_observations()
+        workers:    number of concurrent requests
+    """
+    def timed(query):
+        start = time.perf_counter()
+        try:
+            status_code, response_json = api.get_observations(**query)
+        except requests.RequestException as error:
+            print(f'Request failed: {error}')
+            status_code, response_json = None, None
+        return status_code, response_json, time.perf_counter() - start
+
+    with concurrent.futures.ThreadPoolExecutor(workers) as threads:
+        pending = []
+        for query in queries:
+            pending.append(threads.submit(timed, query))
+            if len(pending) >= 2*workers:
+                yield pending.pop(0).result()
+        for future in pending:
+            yield future.result()
+
+
+def utc_datetime(value: str) -> 'datetime.datetime':
+    """
+    Description:
+        Parses an ISO-8601 time to a naive datetime in UTC. Times without a 
+        UTC offset are taken to be UTC already.
+    Args:
+        value:  ISO-8601 time, e.g. 2020-01-01 or 2020-01-01T06:00+01:00
+    """
+    parsed = datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo:
+        parsed = parsed.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def main(argv: list = None) -> int:
+    """
+    Description:
+        Command line bulk fetch of observations. Run with --help for usage.
+    Args:
+        argv:   command line arguments, defaults to sys.argv[1:]
+    """
+    parser = argparse.ArgumentParser(prog='frost',
+                                     description='Fetch observations from the Frost API to ' +\
+                                                 'Parquet or CSV')
+    parser.add_argument('--stations', help='comma-separated station IDs, e.g. SN18700,SN50540')
+    parser.add_argument('--stations-file', help='file with one station ID per line')
+    parser.add_argument('--coordinates-file',
+                        help='file with one "latitude,longitude" per line, stations around ' +\
+                             'each are used')
+    parser.add_argument('--length-of-square', type=float, default=10.0,
+                        help='side in km of the square searched around each coordinate')
+    parser.add_argument('--elements', help='comma-separated elements, e.g. air_temperature')
+    parser.add_argument('--start', type=utc_datetime, help='start time, ISO-8601')
+    parser.add_argument('--end', type=utc_datetime, help='end time, ISO-8601, default now')
+    parser.add_argument('--chunk-days', type=float, default=365.0,
+                        help='days of data in each request')
+    parser.add_argument('--sources-per-request', type=int, default=20,
+                        help='stations in each request')
+    parser.add_argument('--workers', type=int, default=4, help='concurrent requests')
+    parser.add_argument('--cache-ttl', type=float, default=3600.0,
+                        help='metadata cache time to live in s')
+    parser.add_argument('--credentials', help='path to a credentials file')
+    parser.add_argument('--output', help='output file, .parquet or .csv')
+    parser.add_argument('--test-gets', action='store_true',
+                        help='call every GET endpoint once and exit')
+    args = parser.parse_args(argv)
+
+    api = API(credentials_path = args.credentials)
+    api.cache_ttl = args.cache_ttl
+    if args.test_gets:
+        api.test_gets()
+        return 0
+    if not (args.elements and args.start and args.output):
+        parser.error('--elements, --start and --output are needed to fetch observations')
+
+    sources = []
+    if args.stations:
+        sources += args.stations.split(',')
+    if args.stations_file:
+        with open(args.stations_file) as stations_file:
+            sources += [line.strip() for line in stations_file if line.strip()]
+    if args.coordinates_file:
+        with open(args.coordinates_file) as coordinates_file:
+            for line in coordinates_file:
+                if line.strip():
+                    latitude, longitude = (float(value) for value in line.split(','))
+                    bbox = square_polygon(latitude, longitude, args.length_of_square)
+                    try:
+                        sources += list(discover_sources(api, bbox = bbox,
+                                                         tile_size = args.length_of_square,
+                                                         fields = 'id'))
+                    except DiscoveryError as error:
+                        parser.error(f'finding stations around {latitude},{longitude}: {error}')
+    sources = list(dict.fromkeys(sources))
+    if not sources:
+        parser.error('no stations given, use --stations, --stations-file or --coordinates-file')
+
+    end = args.end or datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    queries = [{'sources': ','.join(sources[i:i + args.sources_per_request]),
+                'reference_time': reference_time,
+                'elements': args.elements}
+               for i in range(0, len(sources), args.sources_per_request)
+               for reference_time in time_chunks(args.start, end,
+                                                 datetime.timedelta(days=args.chunk_days))]
+
+    if args.output.endswith('.parquet'):
+        writer = ParquetWriter(args.output)
+    elif args.output.endswith('.csv'):
+        writer = CSVWriter(args.output)
     else:
-        #test = Stations(latitude=59.9138688,longitude=10.752245399999993,length_of_square=5.0)
-        test =  Stations(latitude=60.396729, longitude=5.329483, length_of_square=5.0)
+        parser.error('--output must end with .parquet or .csv')
+
+    start = time.perf_counter()
+    rows = 0
+    failed = 0
+    empty = 0
+    latencies = []
+    with writer:
+        for status_code, response_json, latency in fetch_concurrently(api, queries, args.workers):
+            latencies.append(latency)
+            if status_code == 200:
+                columns = observation_columns(response_json)
+                writer.write(columns)
+                rows += len(columns['value'])
+            elif status_code == 404:
+                # Frost answers 404 when a chunk has no observations
+                empty += 1
+            else:
+                failed += 1
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    transferred = sum(stats['bytes'] for stats in api.transfer_stats.values())
+
+    def percentile(q):
+        return latencies[min(int(q*len(latencies)), len(latencies) - 1)] if latencies else 0.0
+
+    print(f'{len(queries)} requests ({empty} empty, {failed} failed), {rows} rows, ' +\
+          f'{transferred/1e6:.1f} MB in {elapsed:.1f} s')
+    print(f'Throughput: {rows/elapsed:.0f} rows/s, {len(queries)/elapsed:.2f} requests/s')
+    print(f'Latency: p50 {percentile(0.5):.2f} s, p95 {percentile(0.95):.2f} s, ' +\
+          f'max {percentile(1.0):.2f} s')
+    print(f'Concurrency limit: {api.limiter.limit}, throttled: {api.limiter.stats["throttled"]}')
+    return 1 if failed else 0
+
+
+if __name__=='__main__':
+    sys.exit(main())
@@ -3,4 +3,8 @@ setup(name='frost',
       version='0.1',
       py_modules=['frost'],
       install_requires=['requests'],
+      extras_require={'fast': ['orjson'],
+                      'analysis': ['numpy'],
+                      'arrow': ['pyarrow'],
+                      'netcdf': ['netCDF4', 'numpy']},
       )
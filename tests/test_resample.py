@@ -0,0 +1,65 @@
+import array
+import datetime
+
+import numpy as np
+import pytest
+
+import frost
+
+
+def observations(times, values, source='SN18700:0', element='air_temperature'):
+    return frost.observation_array({'sourceId': [source]*len(times),
+                                    'referenceTime': [time_.strftime('%Y-%m-%dT%H:%M:%S.000Z')
+                                                      for time_ in times],
+                                    'elementId': [element]*len(times),
+                                    'value': array.array('d', values),
+                                    'qualityCode': array.array('i', [0]*len(times))})
+
+
+def hourly(start, hours):
+    return [start + datetime.timedelta(hours=hour) for hour in range(hours)]
+
+
+def test_resample_daily_in_dst_time_zone():
+    # Oslo moves to summer time at 01:00 UTC on 2020-03-29, so that local day has 23 hours
+    times = hourly(datetime.datetime(2020, 3, 27, 23), 72)
+    result = frost.resample(observations(times, [1.0]*len(times)), 'D', 'sum',
+                            timezone = 'Europe/Oslo')
+    days = dict(zip(result['time'].astype('datetime64[D]').astype(str), result['count']))
+    assert days == {'2020-03-28': 24, '2020-03-29': 23, '2020-03-30': 24, '2020-03-31': 1}
+
+
+def test_resample_min_count_and_nan():
+    times = hourly(datetime.datetime(2020, 1, 1), 48)
+    values = [1.0]*24 + [np.nan]*22 + [2.0, 4.0]
+    result = frost.resample(observations(times, values), 'D', 'mean', min_count = 3)
+    assert result['count'].tolist() == [24, 2]
+    assert result['value'][0] == 1.0
+    assert np.isnan(result['value'][1])
+
+
+def test_resample_percentile_per_series():
+    times = hourly(datetime.datetime(2020, 1, 1), 4)
+    data = np.concatenate([observations(times, [4.0, 1.0, 3.0, 2.0]),
+                           observations(times, [10.0, np.nan, 30.0, 20.0], source='SN1:0')])
+    result = frost.resample(data, 'D', 'percentile', percentile = 50)
+    medians = dict(zip(result['source'], result['value']))
+    assert medians == {'SN18700:0': 2.5, 'SN1:0': 20.0}
+
+
+def test_percentile_is_validated_up_front():
+    data = observations(hourly(datetime.datetime(2020, 1, 1), 2), [1.0, 2.0])
+    with pytest.raises(ValueError):
+        frost.resample(data, 'D', 'percentile')
+    with pytest.raises(ValueError):
+        frost.resample(data, 'D', 'percentile', percentile = 101)
+    with pytest.raises(ValueError):
+        frost.rolling(data, 'PT2H', 'percentile')
+
+
+def test_rolling_window_excludes_its_start():
+    # Windows are (time - window, time], like pandas time based rolling
+    times = hourly(datetime.datetime(2020, 1, 1), 4)
+    result = frost.rolling(observations(times, [1.0, 2.0, 3.0, 4.0]), 'PT2H', 'sum')
+    assert result['value'].tolist() == [1.0, 3.0, 5.0, 7.0]
+    assert result['count'].tolist() == [1, 2, 2, 2]
@@ -0,0 +1,94 @@
+import datetime
+import multiprocessing
+
+import pytest
+
+import frost
+
+
+def response(source='SN18700:0', element='air_temperature', hours=range(3), value=1.0,
+             time_offset='PT0H', level=None):
+    observation = {'elementId': element, 'unit': 'degC', 'timeOffset': time_offset,
+                   'timeResolution': 'PT1H', 'qualityCode': 0}
+    if level:
+        observation['level'] = {'levelType': 'height_above_ground', 'unit': 'm', 'value': level}
+    return {'data': [{'sourceId': source,
+                      'referenceTime': f'2020-01-01T{hour:02d}:00:00.000Z',
+                      'observations': [{**observation, 'value': value + hour}]}
+                     for hour in hours]}
+
+
+def day(hour):
+    return datetime.datetime(2020, 1, 1, hour)
+
+
+def write(path, start, end, **kwargs):
+    frost.ObservationStore.write(path, frost.observation_columns(response(**kwargs)),
+                                 day(start), day(end))
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path/'observations.frost')
+
+
+def test_round_trip_matches_main_sensor(path):
+    write(path, 0, 6, level=2)
+    store = frost.ObservationStore(path)
+    stored = store.observations('SN18700', ['air_temperature'], day(0), day(2))
+    assert stored == {'data': [
+        {'sourceId': 'SN18700:0', 'referenceTime': f'2020-01-01T0{hour}:00:00.000Z',
+         'observations': [{'elementId': 'air_temperature', 'value': 1.0 + hour, 'unit': 'degC',
+                           'level': {'levelType': 'height_above_ground', 'unit': 'm',
+                                     'value': 2},
+                           'timeOffset': 'PT0H', 'timeResolution': 'PT1H',
+                           'qualityCode': 0}]}
+        for hour in (0, 1)]}
+    assert store.observations('SN18700', ['air_temperature'], day(0), day(7)) is None
+    assert store.observations('SN1', ['air_temperature'], day(0), day(2)) is None
+    store.close()
+
+
+def test_merge_keeps_series_apart_and_joins_coverage(path):
+    write(path, 0, 3)
+    write(path, 3, 6, hours=range(3, 6), value=10.0)
+    write(path, 0, 6, time_offset='PT6H', value=100.0)
+    write(path, 0, 1, hours=[0], level=10)
+    store = frost.ObservationStore(path)
+    series = {(entry['timeOffset'], entry['level']): entry
+              for entry in store.series('SN18700:0', 'air_temperature')}
+    assert sorted((entry['start'], entry['end'], entry['count'])
+                  for entry in series.values()) == [(1577836800, 1577840400, 1),
+                                                    (1577836800, 1577858400, 3),
+                                                    (1577836800, 1577858400, 6)]
+    times, values, quality = store.lookup(series[('PT0H', None)], day(2), day(4))
+    assert list(values) == [3.0, 13.0]
+    assert list(times) == [1577844000, 1577847600]
+    del times, values, quality
+    # The series at 10 m only covers the first hour
+    assert not store.covers('SN18700', 'air_temperature', day(0), day(2))
+    store.close()
+
+
+def test_disjoint_coverage_keeps_the_longer_range(path):
+    write(path, 0, 6)
+    write(path, 20, 21, hours=[20])
+    store = frost.ObservationStore(path)
+    entry, = store.series('SN18700:0', 'air_temperature')
+    assert (entry['start'], entry['end'], entry['count']) == (1577836800, 1577858400, 4)
+    store.close()
+
+
+def write_source(args):
+    path, number = args
+    write(path, 0, 3, source=f'SN{number}:0')
+
+
+@pytest.mark.skipif(frost.fcntl is None, reason='writes are only locked with fcntl')
+def test_concurrent_writes_keep_every_series(path):
+    with multiprocessing.Pool(4) as pool:
+        pool.map(write_source, [(path, number) for number in range(8)])
+    store = frost.ObservationStore(path)
+    assert sorted(source for source, element in store.index) == [f'SN{number}:0'
+                                                                 for number in range(8)]
+    store.close()